@@ -1,30 +1,37 @@
 from datetime import datetime, timedelta
-import os
 from typing import Annotated, Any, Dict, List
-import google.generativeai as genai
 from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from app.core.security import get_current_active_user
-from app.schemas.schemas import UserOut, ChatMessage, AnalyticsData, GoalBreakdownRequest, GoalBreakdownResponse, SuggestedHabit, ScheduleResponse, ScheduleSuggestion
+from app.schemas.schemas import UserOut, ChatMessage, ChatSessionOut, AnalyticsData, GoalBreakdownRequest, GoalBreakdownResponse, SuggestedHabit, ScheduleResponse, ScheduleSuggestion
 from app.core.database import get_db
+from app.core.config import settings
 from app.models.user import User
+from app.services import breakdown_cache, chat_sessions, completions, llm, insight_cache, scheduling
 import re
 import json
+import time
 from collections import defaultdict # Added import statement for the 're' module
 
-router = APIRouter()
+async def ai_request_deadline():
+    """Share one Gemini time budget across all calls made while serving a request."""
+    with llm.deadline(settings.AI_REQUEST_DEADLINE_SECONDS):
+        yield
 
 # AI Insights router
 router = APIRouter(
     prefix="/api/v1/ai",
     tags=["ai"],
     responses={404: {"description": "Not found"}},
+    dependencies=[Depends(ai_request_deadline)],
 )
 
-# Configure Gemini API
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY environment variable not set")
-genai.configure(api_key=GEMINI_API_KEY)
+def ai_unavailable() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="AI assistant is temporarily unavailable, please try again shortly",
+        headers={"Retry-After": str(int(llm.breaker.retry_after()) + 1)},
+    )
 
 def generate_fallback_insights(habits: List[dict], formatted: bool = False) -> List[dict]:
     if not habits:
@@ -70,7 +77,10 @@ async def get_ai_insights(
     db: Annotated[Any, Depends(get_db)],
 ):
     # ---- fetch habits -------------------------------------------------
-    habits_cursor = db.habits.find({"user_id": str(current_user.id)})
+    habits_cursor = db.habits.find(
+        {"user_id": str(current_user.id)},
+        {"name": 1, "streak": 1, "completion_rate": 1, "last_completed": 1}
+    )
     habits = await habits_cursor.to_list(length=None)
 
     if not habits:
@@ -86,10 +96,16 @@ async def get_ai_insights(
             ]
         }
 
+    # ---- serve cached insights while the habit snapshot is unchanged --
+    fp = insight_cache.fingerprint(habits)
+    cached = await insight_cache.get_cached_insights(db, str(current_user.id), fp)
+    if cached is not None:
+        return {"insights": cached}
+
     # ---- prepare data string -----------------------------------------
     habit_data_str = "\n".join(
         f"- {h.get('name','Unnamed')}: Streak {h.get('streak',0)} days, "
-        f"Completion {h.get('completion_rate',0)}%, Last {h.get('last_completed','N/A')}"
+        f"Completion {h.get('completion_rate',0)}%, Last {str(h.get('last_completed') or 'N/A')[:10]}"
         for h in habits
     )
 
@@ -118,9 +134,8 @@ Do NOT number. Do NOT say "insight". Just speak.
 """
 
     try:
-        model = genai.GenerativeModel("gemini-2.5-flash")   # or gemini-2.0 when available
-        response = model.generate_content(prompt)
-        raw_lines = response.text.strip().split("\n")
+        text = await llm.generate(prompt)
+        raw_lines = text.strip().split("\n")
 
         # clean
         cleaned = [
@@ -146,6 +161,7 @@ Do NOT number. Do NOT say "insight". Just speak.
             for i, ins in enumerate(cleaned[:5])
         ]
 
+        await insight_cache.store_insights(db, str(current_user.id), fp, formatted)
         return {"insights": formatted}
 
     except Exception as exc:
@@ -153,14 +169,25 @@ Do NOT number. Do NOT say "insight". Just speak.
         return {"insights": generate_fallback_insights(habits, formatted=True)}
 
 
+def fallback_intro(name: str) -> List[str]:
+    return [
+        "> NEURAL_ASSISTANT boot sequence initiated...",
+        "> Running system checks... OK",
+        f"> User identified: {name or 'OPERATOR'}",
+        "> Habit matrix loaded.",
+        "> NEURAL_ASSISTANT ready. How can I help you today?",
+    ]
+
 @router.get("/intro", response_model=list[str])
 async def get_ai_intro(current_user: UserOut = Depends(get_current_active_user)):
     try:
-        model = genai.GenerativeModel('gemini-2.5-flash')
         prompt = f"Generate a short, futuristic, and welcoming introduction for a neural assistant named 'NEURAL_ASSISTANT' for a habit tracking application. The user's name is {current_user.name}. The introduction should be in the style of a system boot sequence, including elements like system checks, user identification, and readiness confirmation. Each line should be a distinct message, suitable for a typing animation."
-        response = model.generate_content(prompt)
-        intro_text = response.text.split('\n')
+        text = await llm.generate(prompt)
+        intro_text = text.split('\n')
         return intro_text
+    except llm.LLMError as e:
+        print(f"Gemini intro failed, serving fallback: {e}")
+        return fallback_intro(current_user.name)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Gemini AI intro generation failed: {str(e)}")
 
@@ -177,32 +204,165 @@ async def chat(
         raise HTTPException(status_code=400, detail="Message cannot be empty")
 
     try:
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        
-        chat_session = model.start_chat(history=[{'role': msg.role, 'parts': [msg.content]} for msg in history])
-        
-        response = await chat_session.send_message_async(user_message)
-        
-        ai_response = response.text
+        ai_response = await llm.chat(
+            user_message,
+            history=[{'role': msg.role, 'parts': [msg.content]} for msg in history]
+        )
         
         return {"response": ai_response}
         
+    except llm.CircuitOpenError:
+        raise ai_unavailable()
     except Exception as e:
-        import traceback
-        
         raise HTTPException(status_code=500, detail=f"Gemini AI chat failed: {str(e)}")
 
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post("/chat/stream")
+async def chat_stream(
+    request: Request,
+    message: ChatMessage,
+    history: List[ChatMessage] = [],
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Streaming variant of /chat over Server-Sent Events.
+
+    Emits a `delta` event per generated chunk, then a `done` event with a summary
+    (or an `error` event). Chunks are only pulled from Gemini as fast as the client
+    reads them, and the upstream call is cancelled when the client disconnects.
+    """
+    user_message = message.content
+    if not user_message:
+        raise HTTPException(status_code=400, detail="Message cannot be empty")
+    # Once the response has started the status is 200, so refuse up front while Gemini is known to be down
+    if llm.breaker.rejecting():
+        raise ai_unavailable()
+
+    async def events():
+        started = time.perf_counter()
+        first_chunk_at = None
+        chunks = 0
+        length = 0
+        stream = llm.chat_stream(
+            user_message,
+            history=[{'role': msg.role, 'parts': [msg.content]} for msg in history]
+        )
+        try:
+            async for text in stream:
+                if await request.is_disconnected():
+                    return
+                if first_chunk_at is None:
+                    first_chunk_at = time.perf_counter()
+                chunks += 1
+                length += len(text)
+                yield _sse("delta", {"text": text})
+        except llm.LLMError as e:
+            yield _sse("error", {"detail": f"Gemini AI chat failed: {str(e)}"})
+            return
+        finally:
+            await stream.aclose()
+
+        yield _sse("done", {
+            "chunks": chunks,
+            "characters": length,
+            "time_to_first_chunk_ms": round((first_chunk_at - started) * 1000) if first_chunk_at else None,
+            "duration_ms": round((time.perf_counter() - started) * 1000),
+        })
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def _session_out(session: dict) -> ChatSessionOut:
+    return ChatSessionOut(
+        session_id=str(session["_id"]),
+        summary=session.get("summary", ""),
+        turns=[ChatMessage(role=t["role"], content=t["content"]) for t in session.get("turns", [])],
+    )
+
+@router.post("/chat/sessions", response_model=ChatSessionOut, status_code=201)
+async def create_chat_session(
+    current_user: Annotated[User, Depends(get_current_active_user)],
+    db: Annotated[Any, Depends(get_db)]
+):
+    """Start a server-side chat session; later turns only send the new message."""
+    return _session_out(await chat_sessions.create_session(db, str(current_user.id)))
+
+@router.get("/chat/sessions/{session_id}", response_model=ChatSessionOut)
+async def get_chat_session(
+    session_id: str,
+    current_user: Annotated[User, Depends(get_current_active_user)],
+    db: Annotated[Any, Depends(get_db)]
+):
+    session = await chat_sessions.get_session(db, str(current_user.id), session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Chat session not found")
+    return _session_out(session)
+
+@router.delete("/chat/sessions/{session_id}", status_code=204)
+async def delete_chat_session(
+    session_id: str,
+    current_user: Annotated[User, Depends(get_current_active_user)],
+    db: Annotated[Any, Depends(get_db)]
+):
+    if not await chat_sessions.delete_session(db, str(current_user.id), session_id):
+        raise HTTPException(status_code=404, detail="Chat session not found")
+
+@router.post("/chat/sessions/{session_id}/messages")
+async def chat_in_session(
+    session_id: str,
+    message: ChatMessage,
+    current_user: Annotated[User, Depends(get_current_active_user)],
+    db: Annotated[Any, Depends(get_db)]
+):
+    """Reply to one message using the session's stored context (rolling summary plus recent turns)."""
+    if not message.content:
+        raise HTTPException(status_code=400, detail="Message cannot be empty")
+    session = await chat_sessions.get_session(db, str(current_user.id), session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Chat session not found")
+
+    try:
+        ai_response = await chat_sessions.send_message(db, session, message.content)
+    except llm.CircuitOpenError:
+        raise ai_unavailable()
+    except llm.LLMError as e:
+        raise HTTPException(status_code=500, detail=f"Gemini AI chat failed: {str(e)}")
+    return {"response": ai_response, "session_id": session_id}
+
+def fallback_breakdown(goal: str, duration: str = "daily") -> GoalBreakdownResponse:
+    """Generic, goal-agnostic breakdown served when Gemini is unavailable; never cached."""
+    frequency = duration or "daily"
+    return GoalBreakdownResponse(
+        habits=[
+            SuggestedHabit(name="Take the First Step", description=f"Spend 10 minutes on the smallest possible action toward: {goal}", frequency=frequency, reason="Small, immediate actions build momentum faster than big plans."),
+            SuggestedHabit(name="Plan Tomorrow", description="Write down one concrete task for this goal before bed", frequency="daily", reason="Deciding in advance removes friction when it's time to act."),
+            SuggestedHabit(name="Weekly Review", description="Review what worked this week and adjust your plan", frequency="weekly", reason="Regular reflection keeps the goal realistic and on track."),
+        ],
+        advice="Start small and be consistent. Track every completion, and increase the difficulty only once the habit feels automatic.",
+    )
+
 @router.post("/breakdown", response_model=GoalBreakdownResponse)
 async def breakdown_goal(
     request: GoalBreakdownRequest,
+    db: Annotated[Any, Depends(get_db)],
     current_user: User = Depends(get_current_active_user)
 ):
     """
     Breaks down a user's goal into actionable habits using AI.
+
+    Breakdowns are cached by normalized goal text; the same or a near-identical
+    goal is answered from the cache without calling Gemini.
     """
+    cached = await breakdown_cache.lookup(db, request.goal, request.duration)
+    if cached is not None:
+        return GoalBreakdownResponse(**cached)
+
     try:
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        
         prompt = f"""
         You are an expert habit coach. The user has a goal: "{request.goal}".
         
@@ -230,8 +390,7 @@ async def breakdown_goal(
         Do not include markdown formatting (like ```json). Just the raw JSON string.
         """
         
-        response = model.generate_content(prompt)
-        text_response = response.text.strip()
+        text_response = (await llm.generate(prompt)).strip()
         
         # Clean up potential markdown code blocks if Gemini adds them
         if text_response.startswith("```json"):
@@ -243,99 +402,95 @@ async def breakdown_goal(
             
         data = json.loads(text_response.strip())
         
-        return GoalBreakdownResponse(**data)
+        breakdown = GoalBreakdownResponse(**data)
+        await breakdown_cache.store(db, request.goal, request.duration, breakdown.model_dump())
+        return breakdown
         
+    except llm.LLMError as e:
+        print(f"Gemini breakdown failed, serving fallback: {e}")
+        return fallback_breakdown(request.goal, request.duration)
     except json.JSONDecodeError:
         raise HTTPException(status_code=500, detail="AI returned invalid JSON format")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"AI goal breakdown failed: {str(e)}")
 
+@router.get("/breakdown/cache-stats", response_model=Dict[str, Any])
+async def get_breakdown_cache_stats(current_user: User = Depends(get_current_active_user)):
+    """Hit/miss counts and hit rate of this worker's goal breakdown cache."""
+    return breakdown_cache.stats()
+
+def build_reason_rewrite_prompt(suggestions: List[dict]) -> str:
+    reasons = {s["habit_id"]: {"habit": s["habit_name"], "reason": s["reason"]} for s in suggestions}
+    return f"""
+Rewrite each reminder suggestion reason below to sound friendly and motivating, in one or two sentences.
+Keep every time of day and number exactly as given.
+
+{json.dumps(reasons)}
+
+Return a JSON object mapping each id to its rewritten reason, with the same ids and no other keys.
+"""
+
 @router.get("/schedule-suggestions", response_model=ScheduleResponse)
 async def get_schedule_suggestions(
     db: Annotated[Any, Depends(get_db)],
+    enhance: bool = False,
     current_user: User = Depends(get_current_active_user)
 ):
     """
     Analyzes habit completion history to suggest optimal reminder times.
+
+    Suggestions are computed locally from the last HISTORY_DAYS days of
+    completions (see app.services.scheduling); with
+    `enhance=true` Gemini only rewords the reasons, and the templated reasons
+    are kept if that fails.
     """
-    # 1. Fetch all habits
-    habits_cursor = db.habits.find({"user_id": str(current_user.id)})
-    habits = await habits_cursor.to_list(length=None)
-    
+    habits = await db.habits.find(
+        {"user_id": str(current_user.id)},
+        {"name": 1, "next_reminder_at": 1}
+    ).to_list(length=None)
     if not habits:
         return {"suggestions": []}
 
-    # 2. Fetch completion history
-    completions_cursor = db.habit_completions.find({"user_id": str(current_user.id)})
-    completions = await completions_cursor.to_list(length=None)
-    
-    if not completions:
+    since = datetime.utcnow().date() - timedelta(days=scheduling.HISTORY_DAYS)
+    completion_events = await completions.fetch_completions(db, str(current_user.id), start=since)
+    if not completion_events:
         return {"suggestions": []}
 
-    # 3. Group completions by habit
-    habit_data = defaultdict(list)
-    for c in completions:
-        try:
-            dt = datetime.fromisoformat(c["completed_at"].replace('Z', '+00:00'))
-            habit_data[c["habit_id"]].append(dt.hour) # Store just the hour (0-23)
-        except (ValueError, KeyError):
+    habit_times = defaultdict(list)
+    for c in completion_events:
+        # Migrated history entries carry only a date, no time of day
+        if c.get("date_only"):
             continue
+        habit_times[c["habit_id"]].append(c["completed_at"])
 
-    # 4. Prepare prompt for Gemini
-    analysis_text = "User's habit completion patterns:\n"
-    habits_map = {str(h["_id"]): h for h in habits}
-    
-    has_data = False
-    for habit_id, hours in habit_data.items():
-        if habit_id in habits_map:
-            habit_name = habits_map[habit_id]["name"]
-            avg_hour = sum(hours) / len(hours)
-            analysis_text += f"- Habit: '{habit_name}' (ID: {habit_id}). Completed at hours: {sorted(hours)}. Average hour: {avg_hour:.1f}.\n"
-            has_data = True
-            
-    if not has_data:
-        return {"suggestions": []}
-
-    prompt = f"""
-    {analysis_text}
-    
-    Based on these completion times, suggest an optimal reminder time for each habit.
-    The reminder should be slightly before they usually do it (e.g., 30-60 mins before).
-    
-    Return a JSON object with a list of suggestions:
-    {{
-        "suggestions": [
-            {{
-                "habit_id": "...",
-                "habit_name": "...",
-                "current_time": "None", 
-                "suggested_time": "HH:MM" (24-hour format),
-                "reason": "You usually complete this around 19:00, so a reminder at 18:30 might help."
-            }}
-        ]
-    }}
-    Only include habits where you see a clear pattern.
-    """
-
-    try:
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        response = model.generate_content(prompt)
-        text_response = response.text.strip()
-        
-        # Clean markdown
-        if text_response.startswith("```json"):
-            text_response = text_response[7:]
-        if text_response.startswith("```"):
-            text_response = text_response[3:]
-        if text_response.endswith("```"):
-            text_response = text_response[:-3]
-            
-        data = json.loads(text_response.strip())
-        return ScheduleResponse(**data)
-        
-    except Exception as e:
-        print(f"AI Schedule Error: {e}")
-        return {"suggestions": []}
+    suggestions = []
+    for habit in habits:
+        habit_id = str(habit["_id"])
+        next_reminder_at = habit.get("next_reminder_at")
+        suggestion = scheduling.suggest_reminder(
+            habit_id,
+            habit.get("name", "Unnamed"),
+            habit_times.get(habit_id, []),
+            current_time=next_reminder_at.strftime("%H:%M") if next_reminder_at else None,
+        )
+        if suggestion is not None:
+            suggestions.append(suggestion)
+
+    if enhance and suggestions:
+        try:
+            text = await llm.generate(
+                build_reason_rewrite_prompt(suggestions),
+                generation_config={"response_mime_type": "application/json"}
+            )
+            reasons = json.loads(text)
+            for suggestion in suggestions:
+                reason = reasons.get(suggestion["habit_id"]) if isinstance(reasons, dict) else None
+                if isinstance(reason, str) and reason.strip():
+                    suggestion["reason"] = reason.strip()
+        except Exception as e:
+            print(f"AI Schedule wording error: {e}")
+
+    return ScheduleResponse(suggestions=suggestions)
 
 @router.get("/analytics", response_model=AnalyticsData)
 async def get_analytics_data(
@@ -343,68 +498,37 @@ async def get_analytics_data(
     timeframe: str = "week",  # Add timeframe parameter
     current_user: User = Depends(get_current_active_user)
 ):
-    habits_cursor = db.habits.find({"user_id": str(current_user.id)})
+    habits_cursor = db.habits.find({"user_id": str(current_user.id)}, {"name": 1, "streak": 1})
     habits = await habits_cursor.to_list(length=None)
     
-    # Get completion records for the user
-    completions_cursor = db.habit_completions.find({"user_id": str(current_user.id)})
-    completions = await completions_cursor.to_list(length=None)
-
     # Calculate date ranges based on timeframe
-    end_date = datetime.now()
     if timeframe == "week":
-        start_date = end_date - timedelta(days=7)
         days_count = 7
     elif timeframe == "month":
-        start_date = end_date - timedelta(days=30)
         days_count = 30
     else:  # year
-        start_date = end_date - timedelta(days=365)
         days_count = 365
+    end_date = datetime.utcnow().date()
+    start_date = end_date - timedelta(days=days_count - 1)
 
-    # Initialize metrics
-    timeframe_completions = [0] * days_count
-    habit_counts: Dict[str, int] = {}
-    habit_streaks: Dict[str, int] = {}
-    total_completions = 0
-    active_days_set = set()
+    # Per-day and per-habit counters are computed inside Mongo for the timeframe only
+    breakdown = await completions.completion_breakdown(db, str(current_user.id), start_date, end_date)
+    day_counts = breakdown["by_day"]
+    habit_totals = breakdown["by_habit"]
 
-    # Process completions for the selected timeframe
-    for completion in completions:
-        try:
-            # Handle full ISO format (e.g. 2023-10-27T10:00:00.123456)
-            completion_date = datetime.fromisoformat(completion["completed_at"].replace('Z', '+00:00'))
-        except ValueError:
-            # Fallback for simple date format
-            completion_date = datetime.strptime(completion["completed_at"], "%Y-%m-%d")
-
-        if start_date <= completion_date <= end_date:
-            # Calculate which day index this completion belongs to
-            days_diff = (end_date - completion_date).days
-            if 0 <= days_diff < days_count:
-                timeframe_completions[days_count - 1 - days_diff] += 1
-            
-            # Track active days
-            active_days_set.add(completion_date.strftime("%Y-%m-%d"))
-            total_completions += 1
+    timeframe_completions = [
+        day_counts.get((start_date + timedelta(days=i)).isoformat(), 0)
+        for i in range(days_count)
+    ]
+    total_completions = sum(day_counts.values())
+    active_days = len(day_counts)
 
+    habit_counts: Dict[str, int] = {}
+    habit_streaks: Dict[str, int] = {}
     for habit in habits:
         # Habit Distribution (count completions per habit in timeframe)
         habit_name = habit.get("name", "Unknown Habit")
-        
-        # Helper to parse date safely
-        def parse_date(date_str):
-            try:
-                return datetime.fromisoformat(date_str.replace('Z', '+00:00'))
-            except ValueError:
-                return datetime.strptime(date_str, "%Y-%m-%d")
-
-        habit_completions = len([
-            c for c in completions 
-            if c.get("habit_id") == habit["_id"] 
-            and start_date <= parse_date(c["completed_at"]) <= end_date
-        ])
-        habit_counts[habit_name] = habit_counts.get(habit_name, 0) + habit_completions
+        habit_counts[habit_name] = habit_counts.get(habit_name, 0) + habit_totals.get(str(habit["_id"]), 0)
 
         # Best Performing Habits (current streak)
         streak = habit.get("streak", 0)
@@ -416,8 +540,6 @@ async def get_analytics_data(
     # Calculate success rate based on possible completions vs actual completions
     total_possible_completions = len(habits) * days_count
     success_rate = (total_completions / total_possible_completions) * 100 if total_possible_completions > 0 else 0
-    
-    active_days = len(active_days_set)
 
     # Format for response
     habit_distribution = [{"name": name, "count": count} for name, count in habit_counts.items()]
@@ -2,11 +2,16 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from typing import Annotated, List, Dict, Any
 from app.models.habit import Habit, HabitUpdate, HabitCreate
 from app.services.auth import get_current_active_user
+from app.core.security import invalidate_user
 from app.core.database import get_db
 from app.models.user import User, Badge
 from app.schemas.schemas import HabitCompletionResponse
+from app.services import completions, stats
+from app.services.reminders import reminder_timer
 from bson import ObjectId
+from pymongo import ReturnDocument
 from datetime import datetime, timedelta
+import asyncio
 
 router = APIRouter(
     prefix="/api/v1/habits",
@@ -22,12 +27,13 @@ async def create_habit(habit: HabitCreate, current_user: Annotated[User, Depends
     habit_data["updated_at"] = datetime.utcnow()
     habit_data["streak"] = 0
     habit_data["last_completed"] = None
-    habit_data["completion_history"] = []
 
     if habit_data.get("reminder_enabled"):
         habit_data["next_reminder_at"] = datetime.utcnow() + timedelta(days=1)
     
     result = await db.habits.insert_one(habit_data)
+    reminder_timer.schedule(result.inserted_id, habit_data.get("next_reminder_at"))
+    await stats.on_habit_created(db, str(current_user.id), str(result.inserted_id), habit_data["frequency"])
     created_habit = await db.habits.find_one({"_id": result.inserted_id})
     
     # Convert ObjectId to string for response
@@ -49,84 +55,43 @@ async def get_all_habits(current_user: Annotated[User, Depends(get_current_activ
 
 @router.get("/stats/summary", response_model=Dict[str, Any])
 async def get_habit_stats(current_user: Annotated[User, Depends(get_current_active_user)], db: Annotated[any, Depends(get_db)]):
-    habits_cursor = db.habits.find({"user_id": str(current_user.id)})
-    habits = await habits_cursor.to_list(length=None)
-    
-    today = datetime.utcnow().date().isoformat()
-    
-    total_habits = len(habits)
-    completed_today = sum(1 for habit in habits if habit.get("last_completed") == today)
-    highest_streak = max((habit.get("streak", 0) for habit in habits), default=0)
+    summary = stats.summarize(await stats.get_rollup(db, str(current_user.id)))
+    total_habits = summary["total_habits"]
     
     # Calculate completion rate for the last 7 days
-    completion_rate = 0
-    if total_habits > 0:
-        last_week = [(datetime.utcnow().date() - timedelta(days=i)).isoformat() for i in range(7)]
-        completions = sum(
-            1 for habit in habits 
-            for day in last_week 
-            if day in habit.get("completion_history", [])
-        )
-        possible_completions = total_habits * 7
-        completion_rate = (completions / possible_completions) * 100 if possible_completions > 0 else 0
+    possible_completions = total_habits * 7
+    week_completions = sum(summary["recent_completions"].values())
+    completion_rate = (week_completions / possible_completions) * 100 if possible_completions > 0 else 0
     
     return {
         "total_habits": total_habits,
-        "completed_today": completed_today,
-        "highest_streak": highest_streak,
+        "completed_today": summary["completed_today"],
+        "highest_streak": summary["highest_streak"],
         "completion_rate": round(completion_rate, 2)
     }
 
 @router.get("/stats/detailed", response_model=Dict[str, Any])
 async def get_detailed_habit_stats(current_user: Annotated[User, Depends(get_current_active_user)], db: Annotated[any, Depends(get_db)]):
-    habits_cursor = db.habits.find({"user_id": str(current_user.id)})
-    habits = await habits_cursor.to_list(length=None)
-    
-    today = datetime.utcnow().date().isoformat()
-    
-    total_habits = len(habits)
-    completed_today = sum(1 for habit in habits if habit.get("last_completed") == today)
-    highest_streak = max((habit.get("streak", 0) for habit in habits), default=0)
-    total_streaks = sum(habit.get("streak", 0) for habit in habits)
-    average_streak = total_streaks / total_habits if total_habits > 0 else 0
-    
-    # Habit frequency distribution
-    frequency_distribution = {}
-    for habit in habits:
-        freq = habit.get("frequency", "daily")
-        frequency_distribution[freq] = frequency_distribution.get(freq, 0) + 1
-    
-    # Weekly completion trends
-    last_week_dates = [(datetime.utcnow().date() - timedelta(days=i)).isoformat() for i in range(7)]
-    weekly_completions = {}
-    for date in last_week_dates:
-        completions = sum(1 for habit in habits if date in habit.get("completion_history", []))
-        weekly_completions[date] = completions
+    rollup = await stats.get_rollup(db, str(current_user.id))
+    summary = stats.summarize(rollup)
+    total_habits = summary["total_habits"]
+    completed_today = summary["completed_today"]
     
     return {
         "total_habits": total_habits,
         "completed_today": completed_today,
-        "highest_streak": highest_streak,
-        "average_streak": round(average_streak, 2),
-        "total_completions": sum(len(habit.get("completion_history", [])) for habit in habits),
-        "frequency_distribution": frequency_distribution,
-        "weekly_completions": weekly_completions,
+        "highest_streak": summary["highest_streak"],
+        "average_streak": round(summary["average_streak"], 2),
+        "total_completions": rollup.get("total_completions", 0),
+        "frequency_distribution": {freq: count for freq, count in rollup.get("frequency", {}).items() if count > 0},
+        "weekly_completions": summary["recent_completions"],
         "completion_rate": round((completed_today / total_habits * 100) if total_habits > 0 else 0, 2)
     }
 
 @router.get("/heatmap", response_model=List[Dict[str, Any]])
 async def get_heatmap_data(current_user: Annotated[User, Depends(get_current_active_user)], db: Annotated[any, Depends(get_db)]):
-    habits = await db.habits.find({"user_id": str(current_user.id)}).to_list(length=None)
-    
-    date_counts = {}
-    for habit in habits:
-        for date_str in habit.get("completion_history", []):
-            # Ensure date_str is YYYY-MM-DD
-            if "T" in date_str:
-                date_str = date_str.split("T")[0]
-            date_counts[date_str] = date_counts.get(date_str, 0) + 1
-            
-    return [{"date": date, "count": count} for date, count in date_counts.items()]
+    rollup = await stats.get_rollup(db, str(current_user.id))
+    return [{"date": date, "count": count} for date, count in rollup.get("daily", {}).items() if count > 0]
 
 @router.get("/{habit_id}", response_model=Habit)
 async def get_habit_by_id(habit_id: str, current_user: Annotated[User, Depends(get_current_active_user)], db: Annotated[any, Depends(get_db)]):
@@ -159,6 +124,10 @@ async def update_habit(habit_id: str, habit: HabitUpdate, current_user: Annotate
                 update_data["next_reminder_at"] = None
 
         await db.habits.update_one({"_id": ObjectId(habit_id)}, {"$set": update_data})
+        if "reminder_enabled" in update_data:
+            reminder_timer.schedule(ObjectId(habit_id), update_data["next_reminder_at"])
+        if "frequency" in update_data:
+            await stats.on_frequency_changed(db, str(current_user.id), existing_habit.get("frequency", "daily"), update_data["frequency"])
         
         updated_habit = await db.habits.find_one({"_id": ObjectId(habit_id)})
         if updated_habit is None:
@@ -174,26 +143,65 @@ async def update_habit(habit_id: str, habit: HabitUpdate, current_user: Annotate
 @router.delete("/{habit_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_habit(habit_id: str, current_user: Annotated[User, Depends(get_current_active_user)], db: Annotated[any, Depends(get_db)]):
     try:
-        result = await db.habits.delete_one({"_id": ObjectId(habit_id), "user_id": str(current_user.id)})
-        if result.deleted_count == 0:
+        deleted_habit = await db.habits.find_one_and_delete(
+            {"_id": ObjectId(habit_id), "user_id": str(current_user.id)},
+            projection={"frequency": 1}
+        )
+        if deleted_habit is None:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Habit not found")
+        day_counts = await completions.habit_day_counts(db, habit_id)
+        await stats.on_habit_deleted(db, str(current_user.id), habit_id, deleted_habit.get("frequency", "daily"), day_counts)
+        await completions.delete_habit_completions(db, habit_id)
         return
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid habit ID")
 
+XP_PER_COMPLETION = 10
+
+def _candidate_badges(streak: int, today_str: str) -> List[Badge]:
+    """Badges the user qualifies for after a completion; already-earned ones are filtered server-side."""
+    badges = [
+        # Badge: First Step (First completion)
+        Badge(id="first_step", name="First Step", description="Completed your first habit!", icon="🌱", earned_at=today_str)
+    ]
+    # Badge: Streak Master (7 day streak)
+    if streak >= 7:
+        badges.append(Badge(id="streak_master", name="Streak Master", description="Reached a 7-day streak!", icon="🔥", earned_at=today_str))
+    # Badge: Consistency King (30 day streak)
+    if streak >= 30:
+        badges.append(Badge(id="consistency_king", name="Consistency King", description="Reached a 30-day streak!", icon="👑", earned_at=today_str))
+    return badges
+
 @router.post("/{habit_id}/complete", response_model=HabitCompletionResponse)
 async def complete_habit(habit_id: str, current_user: Annotated[User, Depends(get_current_active_user)], db: Annotated[any, Depends(get_db)]):
     try:
-        habit = await db.habits.find_one({"_id": ObjectId(habit_id), "user_id": str(current_user.id)})
-        if habit is None:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Habit not found")
-        
-        today = datetime.utcnow().date()
+        now = datetime.utcnow()
+        today = now.date()
         today_str = today.isoformat()
+        today_start = completions.day_start(today)
+        yesterday_start = completions.day_start(today - timedelta(days=1))
+        
+        # Check "not completed today" and advance the streak in a single server-side update.
+        # A concurrent double-tap cannot match the filter twice, so it cannot earn XP twice.
+        updated_habit = await db.habits.find_one_and_update(
+            {"_id": ObjectId(habit_id), "user_id": str(current_user.id), "last_completed": {"$ne": today_start}},
+            [{"$set": {
+                "streak": {"$cond": [
+                    {"$eq": ["$last_completed", yesterday_start]},
+                    {"$add": [{"$ifNull": ["$streak", 0]}, 1]},
+                    1
+                ]},
+                "last_completed": today_start,
+                "updated_at": now
+            }}],
+            return_document=ReturnDocument.AFTER
+        )
         
-        # Check if already completed today
-        if habit.get("last_completed") == today_str:
-             # Return existing state if already completed
+        if updated_habit is None:
+            habit = await db.habits.find_one({"_id": ObjectId(habit_id), "user_id": str(current_user.id)})
+            if habit is None:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Habit not found")
+            # Already completed today: return existing state
             return HabitCompletionResponse(
                 habit=Habit(**{**habit, "id": str(habit["_id"])}),
                 xp_gained=0,
@@ -201,129 +209,58 @@ async def complete_habit(habit_id: str, current_user: Annotated[User, Depends(ge
                 new_badges=[]
             )
         
-        # Update streak
-        streak = habit.get("streak", 0)
-        last_completed = habit.get("last_completed")
-        
-        if last_completed:
-            # Parse the date string safely
-            try:
-                # Handle both ISO format and other date string formats
-                if 'T' in last_completed:
-                    last_date = datetime.fromisoformat(last_completed.replace('Z', '+00:00')).date()
-                else:
-                    last_date = datetime.strptime(last_completed, '%Y-%m-%d').date()
-                
-                yesterday = today - timedelta(days=1)
-                
-                if last_date == yesterday:
-                    # Consecutive day, increase streak
-                    streak += 1
-                elif last_date < yesterday:
-                    # Streak broken, reset to 1
-                    streak = 1
-                # If last_date == today, we already returned above
-            except (ValueError, AttributeError):
-                # If date parsing fails, treat as first completion
-                streak = 1
-        else:
-            # First completion
-            streak = 1
-        
-        # Update completion history
-        completion_history = habit.get("completion_history", [])
-        completion_history.append(today_str)
-        
-        # Log detailed completion for AI analysis
-        await db.habit_completions.insert_one({
-            "user_id": str(current_user.id),
-            "habit_id": str(habit_id),
-            "habit_name": habit.get("name"),
-            "completed_at": datetime.utcnow().isoformat(), # Full timestamp
-            "date": today_str # Just the date for easy querying
-        })
-        
-        # Update the habit
-        await db.habits.update_one(
-            {"_id": ObjectId(habit_id)},
-            {"$set": {
-                "last_completed": today_str,
-                "streak": streak,
-                "completion_history": completion_history,
-                "updated_at": datetime.utcnow()
-            }}
-        )
+        streak = updated_habit.get("streak", 1)
 
         # --- GAMIFICATION LOGIC ---
-        xp_gained = 10
-        new_badges = []
-        new_level = None
-        
-        # 1. Update XP
-        current_xp = current_user.xp + xp_gained
-        current_level = current_user.level
-        
-        # 2. Check Level Up (Simple formula: Level = XP // 100 + 1)
-        calculated_level = (current_xp // 100) + 1
-        if calculated_level > current_level:
-            new_level = calculated_level
-            current_level = calculated_level
-            
-        # 3. Check Badges
-        user_badges = current_user.badges or []
-        existing_badge_ids = {b.id for b in user_badges}
-        
-        # Badge: First Step (First completion)
-        if "first_step" not in existing_badge_ids:
-            badge = Badge(
-                id="first_step", 
-                name="First Step", 
-                description="Completed your first habit!", 
-                icon="🌱", 
-                earned_at=today_str
-            )
-            new_badges.append(badge)
-            
-        # Badge: Streak Master (7 day streak)
-        if streak >= 7 and "streak_master" not in existing_badge_ids:
-            badge = Badge(
-                id="streak_master", 
-                name="Streak Master", 
-                description="Reached a 7-day streak!", 
-                icon="🔥", 
-                earned_at=today_str
-            )
-            new_badges.append(badge)
-
-        # Badge: Consistency King (30 day streak)
-        if streak >= 30 and "consistency_king" not in existing_badge_ids:
-            badge = Badge(
-                id="consistency_king", 
-                name="Consistency King", 
-                description="Reached a 30-day streak!", 
-                icon="👑", 
-                earned_at=today_str
-            )
-            new_badges.append(badge)
-            
-        # Update User
-        all_badges = user_badges + new_badges
-        await db.users.update_one(
+        # XP is credited with an atomic increment; level (XP // 100 + 1) and badges are
+        # derived server-side so the stale current_user snapshot is never written back.
+        candidates = _candidate_badges(streak, today_str)
+        user_update = db.users.find_one_and_update(
             {"_id": ObjectId(current_user.id)},
-            {"$set": {
-                "xp": current_xp,
-                "level": current_level,
-                "badges": [b.model_dump() for b in all_badges]
-            }}
+            [
+                {"$set": {
+                    "xp": {"$add": [{"$ifNull": ["$xp", 0]}, XP_PER_COMPLETION]},
+                    "badges": {"$ifNull": ["$badges", []]}
+                }},
+                {"$set": {
+                    "level": {"$max": [{"$ifNull": ["$level", 1]}, {"$add": [{"$floor": {"$divide": ["$xp", 100]}}, 1]}]},
+                    "badges": {"$concatArrays": ["$badges", {"$filter": {
+                        "input": {"$literal": [b.model_dump() for b in candidates]},
+                        "as": "badge",
+                        "cond": {"$not": [{"$in": ["$$badge.id", "$badges.id"]}]}
+                    }}]}
+                }}
+            ],
+            projection={"xp": 1, "level": 1, "badges.id": 1},
+            return_document=ReturnDocument.BEFORE
+        )
+        # Record the completion in the habit's monthly bucket (full timestamp kept for AI analysis)
+        bucket_write = completions.record_completion(
+            db,
+            user_id=str(current_user.id),
+            habit_id=str(habit_id),
+            habit_name=updated_habit.get("name"),
+            completed_at=now,
         )
+        rollup_update = stats.on_habit_completed(db, str(current_user.id), str(habit_id), today_str, streak)
+        previous_user, _, _ = await asyncio.gather(user_update, bucket_write, rollup_update)
+        # XP, level and badges changed: drop the cached user
+        await invalidate_user(db, current_user.id)
+        previous_user = previous_user or {}
+
+        previous_level = previous_user.get("level", 1)
+        calculated_level = ((previous_user.get("xp", 0) + XP_PER_COMPLETION) // 100) + 1
+        new_level = calculated_level if calculated_level > previous_level else None
+
+        existing_badge_ids = {b.get("id") for b in previous_user.get("badges", [])}
+        new_badges = [b for b in candidates if b.id not in existing_badge_ids]
         
-        updated_habit = await db.habits.find_one({"_id": ObjectId(habit_id)})
         # Convert ObjectId to string
         updated_habit["id"] = str(updated_habit["_id"])
         del updated_habit["_id"]
         return HabitCompletionResponse(
             habit=Habit(**updated_habit),
-            xp_gained=xp_gained,
+            xp_gained=XP_PER_COMPLETION,
             new_level=new_level,
             new_badges=[b.model_dump() for b in new_badges]
         )
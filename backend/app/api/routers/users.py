@@ -1,7 +1,7 @@
 from fastapi import APIRouter, HTTPException, status, Depends, Response, Request
 from fastapi.security import OAuth2PasswordRequestForm
 from app.schemas.schemas import LoginRequest, UserIn, UserOut, OnboardingData, UserSettingsUpdate
-from app.core.security import PasswordHasher
+from app.core.security import PasswordHasher, invalidate_user
 from app.core.database import get_db
 from app.core.config import settings
 from app.services.auth import create_access_token
@@ -10,6 +10,7 @@ from typing import Annotated
 from app.models.user import User, UserResponse, UserSettings
 from app.services.auth import get_current_active_user, get_current_user
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 
 
 router = APIRouter(
@@ -49,7 +50,11 @@ async def register_user(user: UserIn, db: Annotated[any, Depends(get_db)]):
         }
     }
     
-    result = await db.users.insert_one(new_user_data)
+    try:
+        result = await db.users.insert_one(new_user_data)
+    except DuplicateKeyError:
+        # Unique indexes on email/username catch concurrent registrations
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email or username already registered")
     
     # Return the created user
     return UserOut(
@@ -188,6 +193,7 @@ async def update_user_settings(
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
+    await invalidate_user(db, current_user.id)
     
     # ✅ Return full user data with updated settings
     updated_user_doc = await db.users.find_one({"_id": user_oid})
@@ -230,6 +236,7 @@ async def complete_onboarding(
             "onboarding_completed": True
         }}
     )
+    await invalidate_user(db, current_user.id)
     
     # Get updated user
     updated_user = await db.users.find_one({"_id": ObjectId(current_user.id)})
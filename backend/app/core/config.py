@@ -16,9 +16,42 @@ class Settings(BaseSettings):
     MAIL_SSL_TLS: bool
     USE_CREDENTIALS: bool
     VALIDATE_CERTS: bool
+    MAIL_POOL_SIZE: int = 4
+    MAIL_IDLE_TIMEOUT_SECONDS: float = 60.0
     PORT: int | None = None
     ENVIRONMENT: str = "development"
     BACKEND_CORS_ORIGINS: list[str] = ["http://localhost:3000"]
+    USER_CACHE_TTL_SECONDS: int = 60
+    USER_CACHE_MAX_SIZE: int = 10000
+    USER_CACHE_BROADCAST: bool = False
+    LLM_MODEL: str = "gemini-2.5-flash"
+    LLM_MAX_CONCURRENCY: int = 8
+    LLM_TIMEOUT_SECONDS: float = 20.0
+    LLM_BREAKER_WINDOW_SECONDS: float = 60.0
+    LLM_BREAKER_MIN_CALLS: int = 10
+    LLM_BREAKER_FAILURE_RATE: float = 0.5
+    LLM_BREAKER_SLOW_SECONDS: float = 10.0
+    LLM_BREAKER_OPEN_SECONDS: float = 30.0
+    AI_REQUEST_DEADLINE_SECONDS: float = 12.0
+    CHAT_CONTEXT_TOKEN_BUDGET: int = 2000
+    CHAT_SUMMARY_MAX_WORDS: int = 200
+    INSIGHT_CACHE_TTL_SECONDS: int = 86400
+    INSIGHT_CACHE_MAX_SIZE: int = 5000
+    INSIGHT_BATCH_SIZE: int = 100
+    INSIGHT_LLM_CONCURRENCY: int = 4
+    INSIGHT_PROMPT_BATCH_SIZE: int = 10
+    BREAKDOWN_CACHE_MAX_SIZE: int = 5000
+    BREAKDOWN_CACHE_TTL_SECONDS: int = 30 * 86400
+    BREAKDOWN_SIMILARITY_THRESHOLD: float = 0.85
+    REMINDER_WINDOW_SECONDS: int = 900
+    AI_INSIGHTS_CRON: str = "0 9 * * 1"
+    STREAK_ALERTS_CRON: str = "0 18 * * *"
+    OUTBOX_DISPATCH_CRON: str = "* * * * *"
+    OUTBOX_BATCH_SIZE: int = 200
+    OUTBOX_MAX_ATTEMPTS: int = 6
+    OUTBOX_BACKOFF_BASE_SECONDS: int = 60
+    OUTBOX_BACKOFF_MAX_SECONDS: int = 3600
+    NOTIFICATION_DIGEST_WINDOW_SECONDS: int = 300
 
     class Config:
         env_file = ".env"
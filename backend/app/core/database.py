@@ -2,6 +2,7 @@ from motor.motor_asyncio import AsyncIOMotorClient
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
+from app.core.metrics import MongoCommandMetrics
 import os
 
 load_dotenv()
@@ -17,7 +18,8 @@ async def lifespan(app: FastAPI):
     print("Connecting to MongoDB...")
     try:
         client = AsyncIOMotorClient(
-            MONGO_DETAILS
+            MONGO_DETAILS,
+            event_listeners=[MongoCommandMetrics()]
         )
         # Test the connection
         await client.admin.command('ping')
@@ -0,0 +1,114 @@
+import os
+import time
+from contextlib import asynccontextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest
+from prometheus_client import multiprocess
+from pymongo import monitoring
+from starlette.responses import Response
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total",
+    "HTTP requests by route template and status code",
+    ["method", "route", "status"],
+)
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route"],
+)
+MONGO_COMMAND_LATENCY = Histogram(
+    "mongo_command_duration_seconds",
+    "MongoDB command latency by command name",
+    ["command", "status"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+BACKGROUND_TASK_DURATION = Histogram(
+    "background_task_duration_seconds",
+    "Background task run duration",
+    ["task", "status"],
+    buckets=(0.01, 0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600),
+)
+EMAIL_SEND_LATENCY = Histogram(
+    "email_send_duration_seconds",
+    "Email send latency",
+    ["status"],
+)
+BREAKDOWN_CACHE_LOOKUPS = Counter(
+    "ai_breakdown_cache_lookups_total",
+    "Goal breakdown cache lookups by result (exact, similar, miss)",
+    ["result"],
+)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request count and latency per route template.
+
+    The template (e.g. /api/v1/habits/{habit_id}/complete) is read from the
+    route FastAPI stores in the scope after matching, so label cardinality stays
+    bounded; unmatched paths are grouped under "unmatched".
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            template = getattr(route, "path", "unmatched")
+            method = scope.get("method", "")
+            HTTP_LATENCY.labels(method, template).observe(time.perf_counter() - start)
+            HTTP_REQUESTS.labels(method, template, str(status_code)).inc()
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """pymongo command listener (used by Motor) recording per-command latency."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_COMMAND_LATENCY.labels(event.command_name, "ok").observe(event.duration_micros / 1_000_000)
+
+    def failed(self, event):
+        MONGO_COMMAND_LATENCY.labels(event.command_name, "error").observe(event.duration_micros / 1_000_000)
+
+
+@asynccontextmanager
+async def track_task(name: str):
+    """Record the duration and outcome of one background task run."""
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        BACKGROUND_TASK_DURATION.labels(name, status).observe(time.perf_counter() - start)
+
+
+def metrics_response() -> Response:
+    # With several uvicorn workers, PROMETHEUS_MULTIPROC_DIR aggregates all of them
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,242 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from pymongo import ASCENDING
+from pymongo.errors import CollectionInvalid, DuplicateKeyError
+
+from app.core.scheduler import WORKER_ID
+from app.core.security import INVALIDATIONS_COLLECTION
+from app.services import completions, stats
+from app.services.insight_cache import INSIGHT_CACHE_COLLECTION
+from app.services.outbox import OUTBOX_COLLECTION
+from app.services.chat_sessions import CHAT_SESSIONS_COLLECTION
+from app.services.breakdown_cache import BREAKDOWN_CACHE_COLLECTION
+
+# Applied versions are recorded here as
+# {"_id": version, "description", "status", "owner", "started_at", "heartbeat_at", "applied_at"}
+MIGRATIONS_COLLECTION = "schema_migrations"
+
+# The worker running a migration renews heartbeat_at this often; a "running"
+# claim whose heartbeat is older than STALE_CLAIM_AFTER belongs to a worker that
+# died mid-migration, however long the migration itself takes
+MIGRATION_HEARTBEAT_SECONDS = 10
+STALE_CLAIM_AFTER = timedelta(seconds=60)
+
+# How often a worker waiting on another worker's migration re-checks it
+MIGRATION_POLL_SECONDS = 2
+
+# Indexes backing every router and background-job query, per collection:
+# (keys, create_index options). Each index is created by the migration version
+# that introduced it (see index_migration).
+INDEXES: Dict[str, List[Tuple[list, dict]]] = {
+    "users": [
+        ([("email", ASCENDING)], {"unique": True, "name": "email_unique"}),
+        ([("username", ASCENDING)], {"unique": True, "name": "username_unique"}),
+    ],
+    "habits": [
+        ([("user_id", ASCENDING)], {"name": "user_id"}),
+        ([("reminder_enabled", ASCENDING), ("next_reminder_at", ASCENDING)], {"name": "reminder_due"}),
+        ([("last_completed", ASCENDING), ("streak", ASCENDING)], {"name": "streak_milestones"}),
+    ],
+    completions.BUCKETS: [
+        ([("habit_id", ASCENDING), ("month", ASCENDING)], {"unique": True, "name": "habit_month_unique"}),
+        ([("user_id", ASCENDING), ("month", ASCENDING)], {"name": "user_month"}),
+    ],
+    INSIGHT_CACHE_COLLECTION: [
+        ([("expires_at", ASCENDING)], {"expireAfterSeconds": 0, "name": "expires_at_ttl"}),
+    ],
+    OUTBOX_COLLECTION: [
+        ([("status", ASCENDING), ("next_attempt_at", ASCENDING)], {"name": "status_next_attempt"}),
+        ([("claim_id", ASCENDING)], {"name": "claim_id"}),
+        ([("user_id", ASCENDING), ("status", ASCENDING)], {"name": "user_status"}),
+        ([("expires_at", ASCENDING)], {"expireAfterSeconds": 0, "name": "expires_at_ttl"}),
+    ],
+    CHAT_SESSIONS_COLLECTION: [
+        ([("user_id", ASCENDING), ("updated_at", ASCENDING)], {"name": "user_updated_at"}),
+    ],
+    BREAKDOWN_CACHE_COLLECTION: [
+        ([("expires_at", ASCENDING)], {"expireAfterSeconds": 0, "name": "expires_at_ttl"}),
+        ([("last_hit_at", ASCENDING)], {"name": "last_hit_at"}),
+    ],
+    # Legacy collection, only read by the bucket migration
+    "habit_completions": [
+        ([("habit_id", ASCENDING)], {"name": "habit_id"}),
+    ],
+}
+
+
+def index_migration(collection: str, *names: str) -> Callable[[object], Awaitable[None]]:
+    """A migration creating only the named indexes of `collection`, as declared in INDEXES."""
+    declared = {options["name"]: (keys, options) for keys, options in INDEXES[collection]}
+    selected = [declared[name] for name in names]
+
+    async def migration(db):
+        for keys, options in selected:
+            await db[collection].create_index(keys, **options)
+
+    return migration
+
+
+async def create_initial_indexes(db):
+    for collection, names in [
+        ("users", ["email_unique", "username_unique"]),
+        ("habits", ["user_id", "reminder_due"]),
+        (completions.BUCKETS, ["habit_month_unique", "user_month"]),
+        ("habit_completions", ["habit_id"]),
+    ]:
+        await index_migration(collection, *names)(db)
+
+
+async def migrate_completion_buckets(db):
+    result = await completions.migrate_legacy_completions(db)
+    print(f"Migrated {result['events']} completions from {result['habits']} habits into buckets")
+
+
+async def backfill_completion_datetimes(db):
+    result = await completions.backfill_datetimes(db)
+    print(f"Converted {result['buckets']} buckets and {result['habits']} habits to BSON datetimes")
+
+
+async def reset_stats_rollups(db):
+    # Rollups saved while buckets were missing or still held string timestamps
+    # are wrong; dropping them makes the next read rebuild from migrated data
+    result = await db[stats.ROLLUPS].delete_many({})
+    print(f"Dropped {result.deleted_count} stats rollups for rebuild")
+
+
+async def clear_breakdown_cache(db):
+    # Entries were keyed and matched with the old goal normalization, which
+    # dropped words like "start" and "more" that change what a goal means
+    result = await db[BREAKDOWN_CACHE_COLLECTION].delete_many({})
+    print(f"Dropped {result.deleted_count} cached goal breakdowns")
+
+
+async def create_invalidation_channel(db):
+    # Capped so it can be tailed by every worker and never grows unbounded
+    try:
+        await db.create_collection(INVALIDATIONS_COLLECTION, capped=True, size=1024 * 1024)
+    except CollectionInvalid:
+        pass
+
+
+# Ordered list of (version, description, migration). Never renumber or remove
+# an entry once released; append new versions at the end.
+MIGRATIONS: List[Tuple[int, str, Callable[[object], Awaitable[None]]]] = [
+    (1, "Create collection indexes", create_initial_indexes),
+    (2, "Move completion history into monthly buckets", migrate_completion_buckets),
+    (3, "Store completion timestamps as BSON datetimes", backfill_completion_datetimes),
+    (4, "Create user cache invalidation channel", create_invalidation_channel),
+    (5, "Create AI insight cache TTL index", index_migration(INSIGHT_CACHE_COLLECTION, "expires_at_ttl")),
+    (6, "Create streak milestone index", index_migration("habits", "streak_milestones")),
+    (7, "Create notification outbox indexes",
+     index_migration(OUTBOX_COLLECTION, "status_next_attempt", "claim_id", "expires_at_ttl")),
+    (8, "Create notification digest index", index_migration(OUTBOX_COLLECTION, "user_status")),
+    (9, "Create chat session index", index_migration(CHAT_SESSIONS_COLLECTION, "user_updated_at")),
+    (10, "Create goal breakdown cache indexes",
+     index_migration(BREAKDOWN_CACHE_COLLECTION, "expires_at_ttl", "last_hit_at")),
+    (11, "Rebuild stats rollups from migrated completion buckets", reset_stats_rollups),
+    (12, "Clear goal breakdowns cached under the old goal normalization", clear_breakdown_cache),
+]
+
+
+async def applied_versions(db) -> List[int]:
+    cursor = db[MIGRATIONS_COLLECTION].find({"status": "applied"}, {"_id": 1})
+    return sorted([doc["_id"] async for doc in cursor])
+
+
+async def _claim(db, version: int, description: str) -> bool:
+    """Try to claim `version`, taking over a stale claim; returns whether this worker now holds it."""
+    now = datetime.utcnow()
+    try:
+        await db[MIGRATIONS_COLLECTION].insert_one({
+            "_id": version,
+            "description": description,
+            "status": "running",
+            "owner": WORKER_ID,
+            "started_at": now,
+            "heartbeat_at": now,
+        })
+        return True
+    except DuplicateKeyError:
+        # Claims without a heartbeat_at predate heartbeats and are matched too
+        takeover = await db[MIGRATIONS_COLLECTION].update_one(
+            {"_id": version, "status": "running", "heartbeat_at": {"$not": {"$gte": now - STALE_CLAIM_AFTER}}},
+            {"$set": {"owner": WORKER_ID, "started_at": now, "heartbeat_at": now}},
+        )
+        return takeover.modified_count == 1
+
+
+async def _apply(db, version: int, migration):
+    """
+    Run a claimed migration, renewing the claim's heartbeat while it runs. If
+    the claim was lost (this worker stalled and another took over) the run is
+    cancelled and an error raised.
+    """
+    run = asyncio.create_task(migration(db))
+
+    async def heartbeat():
+        while not run.done():
+            await asyncio.sleep(MIGRATION_HEARTBEAT_SECONDS)
+            result = await db[MIGRATIONS_COLLECTION].update_one(
+                {"_id": version, "status": "running", "owner": WORKER_ID},
+                {"$set": {"heartbeat_at": datetime.utcnow()}},
+            )
+            if result.matched_count == 0:
+                print(f"Lost claim on migration {version}, cancelling it")
+                run.cancel()
+                return
+
+    beat = asyncio.create_task(heartbeat())
+    try:
+        await run
+    except asyncio.CancelledError:
+        if not run.cancelled():
+            # This worker is shutting down
+            run.cancel()
+            raise
+        raise RuntimeError(f"Migration {version} was taken over by another worker")
+    finally:
+        beat.cancel()
+
+
+async def run_migrations(db) -> List[int]:
+    """
+    Apply pending migrations in version order and return the versions applied.
+
+    Each version is claimed by inserting its record first, so when several
+    workers start at once only one of them runs a given migration; the others
+    wait until it is applied, so no worker serves requests against a
+    half-migrated database. A failed migration releases its claim and raises;
+    a claim left behind by a killed worker is taken over once its heartbeat
+    stops.
+    Migrations must therefore be safe to re-run.
+    """
+    done = set(await applied_versions(db))
+    applied = []
+    for version, description, migration in MIGRATIONS:
+        if version in done:
+            continue
+
+        while not await _claim(db, version, description):
+            record = await db[MIGRATIONS_COLLECTION].find_one({"_id": version}, {"status": 1})
+            if record is not None and record.get("status") == "applied":
+                break
+            # Another worker is applying this version (or just released a failed claim)
+            print(f"Waiting for migration {version} claimed by another worker")
+            await asyncio.sleep(MIGRATION_POLL_SECONDS)
+        else:
+            # Claimed by this worker
+            print(f"Applying migration {version}: {description}")
+            try:
+                await _apply(db, version, migration)
+            except Exception:
+                await db[MIGRATIONS_COLLECTION].delete_one({"_id": version, "owner": WORKER_ID})
+                raise
+
+            await db[MIGRATIONS_COLLECTION].update_one(
+                {"_id": version, "owner": WORKER_ID},
+                {"$set": {"status": "applied", "applied_at": datetime.utcnow()}},
+            )
+            applied.append(version)
+    return applied
@@ -0,0 +1,198 @@
+import asyncio
+import os
+import random
+import socket
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from croniter import croniter
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.core.metrics import track_task
+
+# One document per registered job:
+# {"_id": job name, "cron", "next_run", "last_run", "last_status",
+#  "owner", "expires_at", "heartbeat_at"}
+# next_run/last_run are persisted, so restarts and deploys never re-trigger a
+# job early. A worker may only run a due job while holding its unexpired lease;
+# a worker that dies stops renewing it and another takes the run over once the
+# lease expires. Loops that must run in a single worker hold a standing lease
+# document without a schedule instead (see hold_lease).
+JOB_LEASES_COLLECTION = "job_leases"
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+DEFAULT_LEASE_SECONDS = 60
+POLL_SECONDS = 30
+
+# Missed-run policies: run a late job once and resume the schedule, or skip
+# runs that are later than the job's misfire grace period
+CATCH_UP_ONCE = "once"
+CATCH_UP_SKIP = "skip"
+
+
+@dataclass
+class Job:
+    name: str
+    cron: str
+    func: Callable[[], Awaitable[None]]
+    catch_up: str = CATCH_UP_ONCE
+    misfire_grace_seconds: int = 300
+    jitter_seconds: int = 0
+    retry_seconds: int = 300
+    lease_seconds: int = DEFAULT_LEASE_SECONDS
+
+    def next_after(self, moment: datetime) -> datetime:
+        next_run = croniter(self.cron, moment).get_next(datetime)
+        if self.jitter_seconds:
+            next_run += timedelta(seconds=random.uniform(0, self.jitter_seconds))
+        return next_run
+
+
+async def ensure_schedule(db, job: Job):
+    """Create the job's schedule document on first start, or reschedule it when its cron changed."""
+    existing = await db[JOB_LEASES_COLLECTION].find_one({"_id": job.name}, {"cron": 1})
+    if existing is not None and existing.get("cron") == job.cron:
+        return
+
+    now = datetime.utcnow()
+    try:
+        await db[JOB_LEASES_COLLECTION].update_one(
+            {"_id": job.name, "cron": existing.get("cron") if existing else None},
+            {
+                "$set": {"cron": job.cron, "next_run": job.next_after(now)},
+                "$setOnInsert": {"expires_at": now},
+                "$unset": {"completed_tick": ""},
+            },
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        # Another worker created or rescheduled it concurrently
+        pass
+
+
+async def acquire_lease(db, job: Job) -> Optional[dict]:
+    """Atomically claim a due run of `job`; returns the schedule document as it was before claiming."""
+    now = datetime.utcnow()
+    return await db[JOB_LEASES_COLLECTION].find_one_and_update(
+        {
+            "_id": job.name,
+            "next_run": {"$lte": now},
+            "$or": [{"expires_at": {"$lte": now}}, {"owner": WORKER_ID}],
+        },
+        {"$set": {"owner": WORKER_ID, "expires_at": now + timedelta(seconds=job.lease_seconds), "heartbeat_at": now}},
+        return_document=ReturnDocument.BEFORE,
+    )
+
+
+async def hold_lease(db, name: str, lease_seconds: int = DEFAULT_LEASE_SECONDS) -> bool:
+    """
+    Claim or renew a standing lease that is not tied to a cron schedule, for
+    loops that must run in a single worker; returns whether this worker holds it.
+    """
+    now = datetime.utcnow()
+    try:
+        await db[JOB_LEASES_COLLECTION].update_one(
+            {"_id": name, "$or": [{"expires_at": {"$lte": now}}, {"owner": WORKER_ID}]},
+            {"$set": {"owner": WORKER_ID, "expires_at": now + timedelta(seconds=lease_seconds), "heartbeat_at": now}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        # Held by another worker
+        return False
+    return True
+
+
+async def renew_lease(db, job: Job) -> bool:
+    now = datetime.utcnow()
+    result = await db[JOB_LEASES_COLLECTION].update_one(
+        {"_id": job.name, "owner": WORKER_ID},
+        {"$set": {"expires_at": now + timedelta(seconds=job.lease_seconds), "heartbeat_at": now}},
+    )
+    return result.matched_count == 1
+
+
+async def release_lease(db, job: Job, next_run: datetime, **fields):
+    await db[JOB_LEASES_COLLECTION].update_one(
+        {"_id": job.name, "owner": WORKER_ID},
+        {"$set": {"expires_at": datetime.utcnow(), "next_run": next_run, **fields}},
+    )
+
+
+async def run_due(db, job: Job) -> bool:
+    """
+    Run `job` if it is due and this worker wins its lease; returns whether it ran.
+
+    The lease is renewed every third of its lifetime while the job runs. If the
+    lease is lost (e.g. this worker stalled past expiry and another took over)
+    the run is cancelled. A failed run is retried after `retry_seconds`.
+    """
+    schedule = await acquire_lease(db, job)
+    if schedule is None:
+        return False
+
+    started_at = datetime.utcnow()
+    lateness = (started_at - schedule["next_run"]).total_seconds()
+    if job.catch_up == CATCH_UP_SKIP and lateness > job.misfire_grace_seconds:
+        print(f"Skipping missed run of {job.name} ({int(lateness)}s late)")
+        await release_lease(db, job, job.next_after(started_at), last_status="skipped")
+        return False
+
+    run = asyncio.create_task(job.func())
+
+    async def heartbeat():
+        while not run.done():
+            await asyncio.sleep(job.lease_seconds / 3)
+            if not await renew_lease(db, job):
+                print(f"Lost lease for job {job.name}, cancelling run")
+                run.cancel()
+                return
+
+    beat = asyncio.create_task(heartbeat())
+    try:
+        async with track_task(job.name):
+            await run
+    except asyncio.CancelledError:
+        if not run.cancelled():
+            # This worker is shutting down: stop the run and let the lease expire
+            run.cancel()
+            raise
+        return False
+    except Exception:
+        await release_lease(db, job, started_at + timedelta(seconds=job.retry_seconds), last_status="error")
+        raise
+    finally:
+        beat.cancel()
+
+    # Later runs follow the cron expression, whatever the catch-up policy did
+    await release_lease(db, job, job.next_after(started_at), last_run=started_at, last_status="ok")
+    return True
+
+
+async def _run_job(db, job: Job):
+    try:
+        await run_due(db, job)
+    except Exception as e:
+        print(f"Error in {job.name} task: {e}")
+
+
+async def run_scheduler(get_db, jobs: List[Job]):
+    """Background loop polling for due jobs; each due job runs in its own task."""
+    db = await get_db()
+    for job in jobs:
+        await ensure_schedule(db, job)
+
+    running: Dict[str, asyncio.Task] = {}
+    try:
+        while True:
+            for job in jobs:
+                if job.name in running and not running[job.name].done():
+                    continue
+                running[job.name] = asyncio.create_task(_run_job(db, job))
+            await asyncio.sleep(POLL_SECONDS)
+    finally:
+        for task in running.values():
+            task.cancel()
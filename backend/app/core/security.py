@@ -1,12 +1,17 @@
 from datetime import datetime, timedelta
 from typing import Optional
+import asyncio
+import time
 
 from bson import ObjectId
+from bson.errors import InvalidId
 from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+from pymongo import CursorType
 from app.core.database import get_db
+from app.core.cache import TTLCache
 
 from app.core.config import settings
 from app.schemas.schemas import UserOut
@@ -80,6 +85,92 @@ async def get_token_from_cookie(request: Request) -> str:
         )
     return token
 
+# Authenticated users and validated token claims are cached per worker, so the
+# handful of API calls behind one page view don't each decode the JWT and hit Mongo.
+user_cache = TTLCache(maxsize=settings.USER_CACHE_MAX_SIZE, ttl=settings.USER_CACHE_TTL_SECONDS)
+token_cache = TTLCache(maxsize=settings.USER_CACHE_MAX_SIZE, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+# Capped collection used to broadcast invalidations to other workers
+INVALIDATIONS_COLLECTION = "user_cache_invalidations"
+
+SETTINGS_FIELDS = ["notifications", "aiInsights", "insightFrequency",
+                   "analysisDepth", "habitReminders", "streakAlerts"]
+
+def build_user(user_data: dict) -> User:
+    # Handle settings - create default if not exists
+    settings_data = user_data.get("settings")
+    if settings_data:
+        # Filter only valid UserSettings fields
+        settings_obj = UserSettings(**{k: v for k, v in settings_data.items() if k in SETTINGS_FIELDS})
+    else:
+        settings_obj = UserSettings()
+
+    return User(
+        id=str(user_data["_id"]),
+        email=user_data["email"],
+        username=user_data["username"],
+        is_active=user_data.get("is_active", True),
+        name=user_data.get("name"),
+        personal_goals=user_data.get("personal_goals"),
+        preferred_categories=user_data.get("preferred_categories"),
+        onboarding_completed=user_data.get("onboarding_completed", False),
+        settings=settings_obj,  # Always provide settings
+        xp=user_data.get("xp", 0),
+        level=user_data.get("level", 1),
+        badges=user_data.get("badges", [])
+    )
+
+def decode_token_subject(token: str) -> Optional[str]:
+    """Return the user id (`sub`) of a valid token, caching the claims until the token expires."""
+    user_id = token_cache.get(token)
+    if user_id is not None:
+        return user_id
+
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    user_id = payload.get("sub")
+    if user_id is not None and payload.get("exp"):
+        token_cache.set(token, user_id, ttl=payload["exp"] - time.time())
+    return user_id
+
+async def load_user(db, user_id: str) -> Optional[User]:
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+
+    try:
+        user_data = await db.users.find_one({"_id": ObjectId(user_id)}, {"hashed_password": 0})
+    except InvalidId:
+        return None
+    if not user_data:
+        return None
+
+    user = build_user(user_data)
+    user_cache.set(user_id, user)
+    return user
+
+async def invalidate_user(db, user_id: str):
+    """Drop a cached user after a write to their document (and tell other workers if enabled)."""
+    user_cache.pop(str(user_id))
+    if settings.USER_CACHE_BROADCAST:
+        try:
+            await db[INVALIDATIONS_COLLECTION].insert_one({"user_id": str(user_id), "at": datetime.utcnow()})
+        except Exception as e:
+            print(f"Error broadcasting user cache invalidation: {e}")
+
+async def listen_for_invalidations(db):
+    """Background task tailing the invalidation channel written by other workers."""
+    last_id = None
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id else {"at": {"$gte": datetime.utcnow()}}
+        try:
+            cursor = db[INVALIDATIONS_COLLECTION].find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+            async for doc in cursor:
+                last_id = doc["_id"]
+                user_cache.pop(doc["user_id"])
+        except Exception as e:
+            print(f"Error reading user cache invalidations: {e}")
+        await asyncio.sleep(1)
+
 async def get_current_user(token: str = Depends(get_token_from_cookie), db: any = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -87,46 +178,16 @@ async def get_current_user(token: str = Depends(get_token_from_cookie), db: any
     )
     
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        
-        if user_id is None:
-            raise credentials_exception
-        
-        user_data = await db.users.find_one({"_id": ObjectId(user_id)})
-        if not user_data:
-            raise credentials_exception
-        
-        # Handle settings - create default if not exists
-        settings_data = user_data.get("settings")
-        if settings_data:
-            # Filter only valid UserSettings fields
-            settings_obj = UserSettings(**{
-                k: v for k, v in settings_data.items() 
-                if k in ["notifications", "aiInsights", "insightFrequency", 
-                        "analysisDepth", "habitReminders", "streakAlerts"]
-            })
-        else:
-            # Create default settings
-            settings_obj = UserSettings()
-        
-        user = User(
-            id=str(user_data["_id"]),
-            email=user_data["email"],
-            username=user_data["username"],
-            is_active=user_data.get("is_active", True),
-            name=user_data.get("name"),
-            personal_goals=user_data.get("personal_goals"),
-            preferred_categories=user_data.get("preferred_categories"),
-            onboarding_completed=user_data.get("onboarding_completed", False),
-            settings=settings_obj  # Always provide settings
-        )
-        
-        return user
-        
-    except JWTError as e:
-        print(f"❌ JWT Error: {e}")
+        user_id = decode_token_subject(token)
+    except JWTError:
+        raise credentials_exception
+    if user_id is None:
+        raise credentials_exception
+    
+    user = await load_user(db, user_id)
+    if user is None:
         raise credentials_exception
+    return user
 
 async def get_current_active_user(current_user: User = Depends(get_current_user)):
     if not current_user.is_active:
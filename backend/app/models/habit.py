@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import BaseModel, Field, ConfigDict, field_validator
 from typing import Optional, List
 from datetime import datetime
 
@@ -12,10 +12,19 @@ class Habit(BaseModel):
     updated_at: Optional[datetime] = None
     streak: int = 0
     last_completed: Optional[str] = None
+    # Completions live in habit_completion_buckets; kept for response compatibility
     completion_history: List[str] = []
     reminder_enabled: bool = False
     next_reminder_at: Optional[datetime] = None
 
+    @field_validator("last_completed", mode="before")
+    @classmethod
+    def format_last_completed(cls, value):
+        # Stored as a BSON datetime (midnight UTC); the API keeps returning YYYY-MM-DD
+        if isinstance(value, datetime):
+            return value.date().isoformat()
+        return value
+
     model_config = ConfigDict(
         populate_by_name=True,
         json_schema_extra={
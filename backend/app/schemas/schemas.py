@@ -27,6 +27,11 @@ class ChatMessage(BaseModel):
     role: str
     content: str
 
+class ChatSessionOut(BaseModel):
+    session_id: str
+    summary: str = ""
+    turns: List[ChatMessage] = []
+
 class AnalyticsData(BaseModel):
     weeklyCompletions: List[int]
     habitDistribution: List[Dict[str, Any]]
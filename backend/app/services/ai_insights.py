@@ -1,46 +1,205 @@
-import os
-import google.generativeai as genai
-from datetime import datetime, timedelta
-from typing import List, Optional
+import asyncio
+import json
+from datetime import datetime
+from typing import Any, Dict, List
 
-from beanie import PydanticObjectId
+from pymongo import ReturnDocument
 
+from app.core.config import settings
 from app.core.database import get_db
-from app.models.habit import Habit
-from app.models.user import User
-from app.services.email import send_email
+from app.services import llm, outbox
 
-genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
+# One progress document per weekly run: {"_id": "2026-W42", "status", "last_user_id",
+# "queued", "failed", "started_at", "completed_at"}. Users are processed in _id
+# order and last_user_id is checkpointed after every batch, so a restarted
+# worker resumes the current week's run instead of starting over.
+INSIGHT_RUNS_COLLECTION = "ai_insight_runs"
 
-async def generate_and_send_ai_insights():
-    """Generates and sends AI insights to users who have enabled them."""
-    db = await get_db()
-    model = genai.GenerativeModel('gemini-2.5-flash')
+INSIGHT_USERS_QUERY = {"settings.aiInsights": True, "settings.notifications": True}
+
+# Bounds for an entry of a multi-user batch response to be accepted
+MIN_INSIGHT_LENGTH = 20
+MAX_INSIGHT_LENGTH = 1500
+
+
+def current_run_id(now: datetime = None) -> str:
+    year, week, _ = (now or datetime.utcnow()).isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def build_insight_prompt(user_name: str, habit_names: str) -> str:
+    return f"Generate a short, encouraging and personalized AI insight for a user named {user_name}. " \
+           f"The user's habits include: {habit_names}. Focus on motivation and progress. " \
+           f"Format the insight as a friendly, concise message."
+
+
+def build_batch_insight_prompt(entries: List[Dict[str, str]]) -> str:
+    users_block = "\n".join(
+        f"- id: {e['id']} | name: {e['name']} | habits: {e['habits']}" for e in entries
+    )
+    return f"""
+Generate a short, encouraging and personalized AI insight for each user below.
+Focus on motivation and progress. Each insight is a friendly, concise message of 2-3 sentences
+that mentions the user's name and at least one of their habits.
+
+Users:
+{users_block}
+
+Return a JSON object mapping each user id to that user's insight text, e.g.
+{{"<id>": "<insight>"}}. Include every id exactly once and no other keys.
+"""
+
+
+def parse_batch_insights(text: str, user_ids: List[str]) -> Dict[str, str]:
+    """Return the valid {user_id: insight} entries of a batch response; invalid or missing ids are omitted."""
+    try:
+        data = json.loads(text.strip().removeprefix("```json").removeprefix("```").removesuffix("```"))
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+
+    valid = {}
+    for user_id in user_ids:
+        insight = data.get(user_id)
+        if isinstance(insight, str) and MIN_INSIGHT_LENGTH <= len(insight.strip()) <= MAX_INSIGHT_LENGTH:
+            valid[user_id] = insight.strip()
+    return valid
+
+
+def format_insight_email(user_name: str, insight_text: str) -> str:
+    return f"Hello {user_name},\n\nHere's your weekly AI Insight:\n\n{insight_text}\n\nKeep up the great work!"
+
+
+async def _habit_names_by_user(db, user_ids: List[str]) -> Dict[str, str]:
+    names: Dict[str, List[str]] = {}
+    async for habit in db.habits.find({"user_id": {"$in": user_ids}}, {"user_id": 1, "name": 1}):
+        names.setdefault(habit["user_id"], []).append(habit.get("name", "Unnamed"))
+    return {user_id: ", ".join(habits) for user_id, habits in names.items()}
 
-    users_cursor = db.users.find({"settings.aiInsights": True, "settings.notifications": True})
-    async for user_dict in users_cursor:
+
+async def _process_batch(db, users: List[Dict[str, Any]], run_id: str) -> Dict[str, int]:
+    """
+    Generate insights for one batch of users and enqueue them in the notification outbox.
+
+    Each insight is keyed by user and run, so a resumed run never emails a user
+    twice, and users whose insight is already enqueued are skipped so it is not
+    generated again. If the Gemini circuit opens, the remaining groups are
+    cancelled, the insights generated so far are enqueued, and CircuitOpenError
+    is raised.
+    """
+    keys = [outbox.insight_key(str(u["_id"]), run_id) for u in users]
+    enqueued = {doc["_id"] async for doc in db[outbox.OUTBOX_COLLECTION].find({"_id": {"$in": keys}}, {"_id": 1})}
+    users = [u for u, key in zip(users, keys) if key not in enqueued]
+    habit_names = await _habit_names_by_user(db, [str(u["_id"]) for u in users])
+    generation_slots = asyncio.Semaphore(settings.INSIGHT_LLM_CONCURRENCY)
+    notifications: List[Dict[str, Any]] = []
+    outcome = {"queued": 0, "failed": 0}
+
+    def habits_of(user) -> str:
+        return habit_names.get(str(user["_id"]), "no habits yet")
+
+    def queue_insight(user, insight_text):
+        notifications.append(outbox.notification(
+            outbox.insight_key(str(user["_id"]), run_id),
+            kind="ai_insight",
+            user_id=str(user["_id"]),
+            recipients=[user["email"]],
+            subject="Your Weekly AI Insight",
+            body=format_insight_email(user.get("name", "User"), insight_text),
+            summary=insight_text,
+            user_name=user.get("name"),
+        ))
+
+    async def generate_single(user):
+        user_name = user.get("name", "User")
         try:
-            # user_dict is a plain dict from MongoDB, not a User model instance
-            user_id = str(user_dict["_id"])
-            user_name = user_dict.get("name", "User")
-            user_email = user_dict.get("email")
-            
-            if not user_email:
-                continue
-            
-            # Get user's habits
-            user_habits = await db.habits.find({"user_id": user_id}).to_list(length=None)
-            habit_names = ", ".join([habit.get("name", "Unnamed") for habit in user_habits]) if user_habits else "no habits yet"
-
-            prompt = f"Generate a short, encouraging and personalized AI insight for a user named {user_name}. " \
-                     f"The user's habits include: {habit_names}. Focus on motivation and progress. " \
-                     f"Format the insight as a friendly, concise message."
-            response = model.generate_content(prompt)
-            insight_content = f"Hello {user_name},\n\nHere's your weekly AI Insight:\n\n{response.text}\n\nKeep up the great work!"
-            await send_email(
-                subject="Your Weekly AI Insight",
-                recipient=user_email,
-                body=insight_content
-            )
+            async with generation_slots:
+                insight_text = await llm.generate(build_insight_prompt(user_name, habits_of(user)))
+        except llm.CircuitOpenError:
+            raise
         except Exception as e:
-            print(f"Error sending AI insight to user: {e}")
+            print(f"Error generating AI insight for user {user['_id']}: {e}")
+            outcome["failed"] += 1
+            return
+        queue_insight(user, insight_text)
+
+    async def generate(group):
+        """Generate insights for a group of users with one prompt, falling back to per-user calls."""
+        insights: Dict[str, str] = {}
+        if len(group) > 1:
+            entries = [{"id": str(u["_id"]), "name": u.get("name", "User"), "habits": habits_of(u)} for u in group]
+            try:
+                async with generation_slots:
+                    text = await llm.generate(
+                        build_batch_insight_prompt(entries),
+                        generation_config={"response_mime_type": "application/json"}
+                    )
+                insights = parse_batch_insights(text, [e["id"] for e in entries])
+            except llm.CircuitOpenError:
+                raise
+            except Exception as e:
+                print(f"Error generating batched AI insights: {e}")
+
+        for user in group:
+            insight_text = insights.get(str(user["_id"]))
+            if insight_text is None:
+                await generate_single(user)
+            else:
+                queue_insight(user, insight_text)
+
+    group_size = max(1, settings.INSIGHT_PROMPT_BATCH_SIZE)
+    circuit_open = None
+    try:
+        # The first group to hit an open circuit cancels the others
+        async with asyncio.TaskGroup() as groups:
+            for i in range(0, len(users), group_size):
+                groups.create_task(generate(users[i:i + group_size]))
+    except* llm.CircuitOpenError as errors:
+        circuit_open = errors.exceptions[0]
+
+    outcome["queued"] = await outbox.enqueue(db, notifications)
+    if circuit_open is not None:
+        raise circuit_open
+    return outcome
+
+
+async def generate_and_send_ai_insights():
+    """Generates and sends AI insights to users who have enabled them, resuming an interrupted run."""
+    db = await get_db()
+    run_id = current_run_id()
+
+    run = await db[INSIGHT_RUNS_COLLECTION].find_one_and_update(
+        {"_id": run_id},
+        {"$setOnInsert": {"status": "running", "last_user_id": None, "queued": 0, "failed": 0, "started_at": datetime.utcnow()}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    if run.get("status") == "completed":
+        print(f"AI insight run {run_id} already completed")
+        return
+
+    last_user_id = run.get("last_user_id")
+    while True:
+        query = dict(INSIGHT_USERS_QUERY, email={"$ne": None})
+        if last_user_id is not None:
+            query["_id"] = {"$gt": last_user_id}
+        users = await db.users.find(query, {"name": 1, "email": 1}) \
+            .sort("_id", 1).limit(settings.INSIGHT_BATCH_SIZE).to_list(length=None)
+        if not users:
+            break
+
+        # An open Gemini circuit aborts the run before this batch is checkpointed;
+        # the scheduler retries it and the run resumes here, skipping the users
+        # whose insights were already enqueued
+        outcome = await _process_batch(db, users, run_id)
+        last_user_id = users[-1]["_id"]
+        await db[INSIGHT_RUNS_COLLECTION].update_one(
+            {"_id": run_id},
+            {"$set": {"last_user_id": last_user_id}, "$inc": outcome},
+        )
+
+    await db[INSIGHT_RUNS_COLLECTION].update_one(
+        {"_id": run_id},
+        {"$set": {"status": "completed", "completed_at": datetime.utcnow()}},
+    )
@@ -0,0 +1,239 @@
+import asyncio
+import random
+import re
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.core.metrics import BREAKDOWN_CACHE_LOOKUPS
+
+# Generated /ai/breakdown responses, keyed by normalized goal text and duration:
+# {"_id": "<duration>|<normalized goal>", "goal", "duration", "response",
+#  "hits", "created_at", "last_hit_at", "expires_at"}
+# A TTL index on expires_at drops entries nobody has asked for in a while.
+#
+# Near-duplicate goals ("Lose weight!", "lose some weight") are matched in
+# memory: each goal's character shingles are MinHashed, signatures are split
+# into LSH bands so only goals sharing a band are compared, and the best
+# candidate is served if its numbers and polarity words are the same and its
+# shingle Jaccard similarity reaches BREAKDOWN_SIMILARITY_THRESHOLD.
+BREAKDOWN_CACHE_COLLECTION = "goal_breakdown_cache"
+
+SHINGLE_SIZE = 3
+NUM_HASHES = 64
+BAND_ROWS = 4
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240601)
+_HASH_PARAMS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_HASHES)]
+
+# Filler words that don't change what a goal is about
+STOPWORDS = {
+    "a", "an", "the", "i", "im", "my", "me", "to", "want", "would", "like", "need",
+    "wanna", "be", "able", "get", "some", "and", "please",
+}
+
+# Words that flip or scale a goal ("start" vs "stop eating sugar", "eat more" vs
+# "eat less"). Together with numbers they must match exactly for a similar goal
+# to be served, however close the rest of the text is.
+POLARITY_WORDS = {
+    "start", "begin", "stop", "quit", "avoid", "no", "not", "never", "without",
+    "more", "less", "fewer", "increase", "reduce", "decrease", "cut", "limit",
+}
+
+
+def _singular(word: str) -> str:
+    return word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+
+
+def normalize_goal(goal: str) -> str:
+    """Lowercase, strip punctuation, filler words and plural endings: "Read more books!" -> "read book"."""
+    words = re.findall(r"[a-z0-9]+", goal.lower())
+    kept = [w for w in words if w not in STOPWORDS] or words
+    return " ".join(_singular(w) for w in kept)
+
+
+def anchors(normalized: str) -> FrozenSet[str]:
+    """The words of a normalized goal that must match exactly: numbers and POLARITY_WORDS."""
+    return frozenset(w for w in normalized.split() if w in POLARITY_WORDS or any(c.isdigit() for c in w))
+
+
+def shingles(text: str) -> Set[str]:
+    padded = f" {text} "
+    if len(padded) <= SHINGLE_SIZE:
+        return {padded}
+    return {padded[i:i + SHINGLE_SIZE] for i in range(len(padded) - SHINGLE_SIZE + 1)}
+
+
+def minhash(grams: Set[str]) -> Tuple[int, ...]:
+    values = [zlib.crc32(g.encode()) for g in grams]
+    return tuple(min((a * v + b) % _PRIME for v in values) for a, b in _HASH_PARAMS)
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+def _bands(signature: Tuple[int, ...]) -> List[Tuple[int, Tuple[int, ...]]]:
+    return [(i, signature[i:i + BAND_ROWS]) for i in range(0, len(signature), BAND_ROWS)]
+
+
+class _Entry:
+    __slots__ = ("grams", "signature", "anchors", "response")
+
+    def __init__(self, grams: Set[str], signature: Tuple[int, ...], anchors: FrozenSet[str], response: Dict[str, Any]):
+        self.grams = grams
+        self.signature = signature
+        self.anchors = anchors
+        self.response = response
+
+
+class BreakdownIndex:
+    """Bounded LRU of cached breakdowns with an LSH band index for near-duplicate lookup."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._buckets: Dict[Tuple[str, int, Tuple[int, ...]], Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, key: str, duration: str, goal: str, response: Dict[str, Any]):
+        self.remove(key)
+        grams = shingles(goal)
+        entry = _Entry(grams, minhash(grams), anchors(goal), response)
+        self._entries[key] = entry
+        for band in _bands(entry.signature):
+            self._buckets.setdefault((duration, *band), set()).add(key)
+        while len(self._entries) > self.maxsize:
+            self.remove(next(iter(self._entries)))
+
+    def remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        duration = key.split("|", 1)[0]
+        for band in _bands(entry.signature):
+            bucket = self._buckets.get((duration, *band))
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[(duration, *band)]
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry.response
+
+    def most_similar(self, duration: str, goal: str, threshold: float) -> Optional[Tuple[str, float]]:
+        grams = shingles(goal)
+        candidates: Set[str] = set()
+        for band in _bands(minhash(grams)):
+            candidates |= self._buckets.get((duration, *band), set())
+
+        required = anchors(goal)
+        best: Optional[Tuple[str, float]] = None
+        for key in candidates:
+            if self._entries[key].anchors != required:
+                continue
+            score = jaccard(grams, self._entries[key].grams)
+            if score >= threshold and (best is None or score > best[1]):
+                best = (key, score)
+        if best is not None:
+            self._entries.move_to_end(best[0])
+        return best
+
+
+_index = BreakdownIndex(maxsize=settings.BREAKDOWN_CACHE_MAX_SIZE)
+_loaded = False
+_load_lock: Optional[asyncio.Lock] = None
+_stats = {"exact": 0, "similar": 0, "miss": 0}
+
+
+def cache_key(goal: str, duration: Optional[str]) -> Tuple[str, str, str]:
+    """Return (key, duration, normalized goal) for a breakdown request."""
+    duration = re.sub(r"[^a-z0-9]+", "-", (duration or "daily").lower()).strip("-") or "daily"
+    normalized = normalize_goal(goal)
+    return f"{duration}|{normalized}", duration, normalized
+
+
+def stats() -> Dict[str, Any]:
+    lookups = sum(_stats.values())
+    hits = _stats["exact"] + _stats["similar"]
+    return {**_stats, "entries": len(_index), "hit_rate": round(hits / lookups, 3) if lookups else 0.0}
+
+
+def _record(result: str):
+    _stats[result] += 1
+    BREAKDOWN_CACHE_LOOKUPS.labels(result).inc()
+
+
+async def _ensure_loaded(db):
+    """Fill the in-memory index with the most recently used stored breakdowns, once per process."""
+    global _loaded, _load_lock
+    if _loaded:
+        return
+    if _load_lock is None:
+        _load_lock = asyncio.Lock()
+    async with _load_lock:
+        if _loaded:
+            return
+        cursor = db[BREAKDOWN_CACHE_COLLECTION].find({}, {"goal": 1, "duration": 1, "response": 1}) \
+            .sort("last_hit_at", -1).limit(settings.BREAKDOWN_CACHE_MAX_SIZE)
+        async for doc in cursor:
+            _index.add(doc["_id"], doc["duration"], doc["goal"], doc["response"])
+        _loaded = True
+
+
+async def _touch(db, key: str):
+    now = datetime.utcnow()
+    await db[BREAKDOWN_CACHE_COLLECTION].update_one(
+        {"_id": key},
+        {"$inc": {"hits": 1}, "$set": {"last_hit_at": now,
+                                       "expires_at": now + timedelta(seconds=settings.BREAKDOWN_CACHE_TTL_SECONDS)}},
+    )
+
+
+async def lookup(db, goal: str, duration: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Return a stored breakdown for this goal or a near-identical one, or None."""
+    await _ensure_loaded(db)
+    key, duration, normalized = cache_key(goal, duration)
+
+    response = _index.get(key)
+    if response is None:
+        # Stored by another worker, or evicted from this one
+        doc = await db[BREAKDOWN_CACHE_COLLECTION].find_one({"_id": key}, {"response": 1})
+        if doc is not None:
+            response = doc["response"]
+            _index.add(key, duration, normalized, response)
+    if response is not None:
+        _record("exact")
+        await _touch(db, key)
+        return response
+
+    match = _index.most_similar(duration, normalized, settings.BREAKDOWN_SIMILARITY_THRESHOLD)
+    if match is None:
+        _record("miss")
+        return None
+    _record("similar")
+    await _touch(db, match[0])
+    return _index.get(match[0])
+
+
+async def store(db, goal: str, duration: Optional[str], response: Dict[str, Any]):
+    key, duration, normalized = cache_key(goal, duration)
+    now = datetime.utcnow()
+    _index.add(key, duration, normalized, response)
+    await db[BREAKDOWN_CACHE_COLLECTION].update_one(
+        {"_id": key},
+        {
+            "$set": {"goal": normalized, "duration": duration, "response": response, "last_hit_at": now,
+                     "expires_at": now + timedelta(seconds=settings.BREAKDOWN_CACHE_TTL_SECONDS)},
+            "$setOnInsert": {"hits": 0, "created_at": now},
+        },
+        upsert=True,
+    )
@@ -0,0 +1,164 @@
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReturnDocument
+
+from app.core.config import settings
+from app.services import llm
+
+# One document per conversation:
+# {"_id", "user_id", "created_at", "updated_at", "summary", "summarized_turns",
+#  "turns": [{"role": "user" | "model", "content", "at"}]}
+# `turns` only holds turns not yet folded into `summary`; summarized_turns counts
+# the folded ones and doubles as the version for optimistic summary updates.
+CHAT_SESSIONS_COLLECTION = "chat_sessions"
+
+# Rough chars-per-token ratio for budgeting without calling a tokenizer
+CHARS_PER_TOKEN = 4
+
+# Sessions with a summary update in flight in this process, and the tasks doing it
+_summarizing: Set[ObjectId] = set()
+_tasks: Set[asyncio.Task] = set()
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _session_oid(session_id: str) -> Optional[ObjectId]:
+    try:
+        return ObjectId(session_id)
+    except (InvalidId, TypeError):
+        return None
+
+
+async def create_session(db, user_id: str) -> Dict[str, Any]:
+    now = datetime.utcnow()
+    session = {"user_id": user_id, "created_at": now, "updated_at": now, "summary": "", "summarized_turns": 0, "turns": []}
+    result = await db[CHAT_SESSIONS_COLLECTION].insert_one(session)
+    session["_id"] = result.inserted_id
+    return session
+
+
+async def get_session(db, user_id: str, session_id: str) -> Optional[Dict[str, Any]]:
+    oid = _session_oid(session_id)
+    if oid is None:
+        return None
+    return await db[CHAT_SESSIONS_COLLECTION].find_one({"_id": oid, "user_id": user_id})
+
+
+async def delete_session(db, user_id: str, session_id: str) -> bool:
+    oid = _session_oid(session_id)
+    if oid is None:
+        return False
+    result = await db[CHAT_SESSIONS_COLLECTION].delete_one({"_id": oid, "user_id": user_id})
+    return result.deleted_count == 1
+
+
+def split_context(turns: List[Dict[str, Any]], budget: int) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Split turns into (older, recent): the newest turns fitting `budget` tokens are kept verbatim."""
+    used = 0
+    start = len(turns)
+    while start > 0:
+        cost = estimate_tokens(turns[start - 1]["content"])
+        if used + cost > budget and start < len(turns):
+            break
+        used += cost
+        start -= 1
+    # Never open the verbatim window on a model turn
+    if start < len(turns) and turns[start]["role"] == "model":
+        start += 1
+    return turns[:start], turns[start:]
+
+
+def build_history(summary: str, recent: List[Dict[str, Any]]) -> List[dict]:
+    """Gemini-format history: the rolling summary as an opening exchange, then recent turns verbatim."""
+    history = []
+    if summary:
+        history.append({"role": "user", "parts": [f"Summary of our conversation so far:\n{summary}"]})
+        history.append({"role": "model", "parts": ["Understood, I'll keep that in mind."]})
+    history.extend({"role": t["role"], "parts": [t["content"]]} for t in recent)
+    return history
+
+
+def build_summary_prompt(summary: str, turns: List[Dict[str, Any]]) -> str:
+    transcript = "\n".join(f"{t['role']}: {t['content']}" for t in turns)
+    return f"""
+Update the running summary of a conversation between a user and their habit-tracking assistant.
+Keep facts about the user's goals, habits, preferences and any commitments made. Be concise
+(at most {settings.CHAT_SUMMARY_MAX_WORDS} words), written in the third person.
+
+Current summary:
+{summary or "(empty)"}
+
+New turns to fold in:
+{transcript}
+
+Return only the updated summary text.
+"""
+
+
+async def _fold_into_summary(db, session_id: ObjectId, summary: str, version: int, turns: List[Dict[str, Any]]):
+    try:
+        # Runs after the request returned, so it gets its own budget instead of the request's
+        with llm.deadline(settings.LLM_TIMEOUT_SECONDS):
+            new_summary = (await llm.generate(build_summary_prompt(summary, turns))).strip()
+        # Only applies if nobody folded turns in the meantime
+        await db[CHAT_SESSIONS_COLLECTION].update_one(
+            {"_id": session_id, "summarized_turns": version},
+            [{"$set": {
+                "summary": new_summary,
+                "summarized_turns": version + len(turns),
+                "turns": {"$slice": ["$turns", len(turns), {"$max": [{"$size": "$turns"}, 1]}]},
+            }}],
+        )
+    except Exception as e:
+        print(f"Error summarizing chat session {session_id}: {e}")
+    finally:
+        _summarizing.discard(session_id)
+
+
+def schedule_summary(db, session: Dict[str, Any], older: List[Dict[str, Any]]):
+    """Fold `older` turns into the session summary in the background; no-op if one is already running."""
+    if not older or session["_id"] in _summarizing:
+        return
+    _summarizing.add(session["_id"])
+    task = asyncio.create_task(_fold_into_summary(
+        db, session["_id"], session.get("summary", ""), session.get("summarized_turns", 0), older
+    ))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def send_message(db, session: Dict[str, Any], content: str) -> str:
+    """
+    Reply to `content` within `session` and record both turns.
+
+    The model sees the rolling summary plus the most recent turns fitting
+    CHAT_CONTEXT_TOKEN_BUDGET. Turns that fell out of the budget are folded
+    into the summary after the reply, off the request path; until that
+    finishes they are simply left out of the context.
+    """
+    _, recent = split_context(session.get("turns", []), settings.CHAT_CONTEXT_TOKEN_BUDGET)
+    reply = await llm.chat(content, history=build_history(session.get("summary", ""), recent))
+
+    now = datetime.utcnow()
+    updated = await db[CHAT_SESSIONS_COLLECTION].find_one_and_update(
+        {"_id": session["_id"]},
+        {
+            "$push": {"turns": {"$each": [
+                {"role": "user", "content": content, "at": now},
+                {"role": "model", "content": reply, "at": now},
+            ]}},
+            "$set": {"updated_at": now},
+        },
+        projection={"summary": 1, "summarized_turns": 1, "turns": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if updated is not None:
+        older, _ = split_context(updated["turns"], settings.CHAT_CONTEXT_TOKEN_BUDGET)
+        schedule_summary(db, updated, older)
+    return reply
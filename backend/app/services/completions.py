@@ -0,0 +1,272 @@
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, List, Optional
+
+from pymongo import UpdateOne
+
+# Completions are stored as one bucket document per habit per month:
+# {"user_id", "habit_id", "month": "YYYY-MM", "count", "events": [{"at": datetime}]}
+# so recording a completion is a constant-size upsert and habit documents
+# no longer carry an ever-growing history array. Events backfilled from the
+# legacy date-only history are flagged with "date_only": True.
+BUCKETS = "habit_completion_buckets"
+
+# Day key (UTC) of an unwound event, computed server-side
+EVENT_DAY = {"$dateToString": {"format": "%Y-%m-%d", "date": "$events.at"}}
+
+
+def bucket_month(day: date) -> str:
+    return day.strftime("%Y-%m")
+
+
+def day_start(day: date) -> datetime:
+    """Midnight (UTC) of a day, the BSON datetime used for date-only values."""
+    return datetime.combine(day, time.min)
+
+
+async def record_completion(db, user_id: str, habit_id: str, habit_name: Optional[str], completed_at: datetime):
+    """Append a single completion event to the habit's bucket for that month."""
+    await db[BUCKETS].update_one(
+        {"habit_id": habit_id, "month": bucket_month(completed_at)},
+        {
+            "$setOnInsert": {"user_id": user_id},
+            "$set": {"habit_name": habit_name},
+            "$inc": {"count": 1},
+            "$push": {"events": {"at": completed_at}},
+        },
+        upsert=True,
+    )
+
+
+async def delete_habit_completions(db, habit_id: str):
+    await db[BUCKETS].delete_many({"habit_id": habit_id})
+
+
+def _bucket_match(user_id: str, start: Optional[date] = None, end: Optional[date] = None) -> Dict[str, Any]:
+    match: Dict[str, Any] = {"user_id": user_id}
+    if start or end:
+        match["month"] = {}
+        if start:
+            match["month"]["$gte"] = bucket_month(start)
+        if end:
+            match["month"]["$lte"] = bucket_month(end)
+    return match
+
+
+def _event_match(start: Optional[date] = None, end: Optional[date] = None) -> Dict[str, Any]:
+    match: Dict[str, Any] = {}
+    if start:
+        match["$gte"] = day_start(start)
+    if end:
+        match["$lt"] = day_start(end + timedelta(days=1))
+    return {"events.at": match} if match else {}
+
+
+async def fetch_completions(db, user_id: str, start: Optional[date] = None, end: Optional[date] = None) -> List[Dict[str, Any]]:
+    """Return flattened completion events ({habit_id, habit_name, completed_at, date_only}) for a user."""
+    pipeline = [
+        {"$match": _bucket_match(user_id, start, end)},
+        {"$unwind": "$events"},
+    ]
+    event_match = _event_match(start, end)
+    if event_match:
+        pipeline.append({"$match": event_match})
+    pipeline.append({"$project": {
+        "_id": 0,
+        "habit_id": 1,
+        "habit_name": 1,
+        "completed_at": "$events.at",
+        "date_only": {"$ifNull": ["$events.date_only", False]},
+    }})
+    return await db[BUCKETS].aggregate(pipeline).to_list(length=None)
+
+
+async def completion_day_counts(db, user_id: str, start: Optional[date] = None, end: Optional[date] = None) -> Dict[str, int]:
+    """Return {"YYYY-MM-DD": completions} for a user, optionally limited to a date range."""
+    pipeline = [
+        {"$match": _bucket_match(user_id, start, end)},
+        {"$unwind": "$events"},
+    ]
+    event_match = _event_match(start, end)
+    if event_match:
+        pipeline.append({"$match": event_match})
+    pipeline.append({"$group": {"_id": EVENT_DAY, "count": {"$sum": 1}}})
+    rows = await db[BUCKETS].aggregate(pipeline).to_list(length=None)
+    return {row["_id"]: row["count"] for row in rows}
+
+
+async def habit_day_counts(db, habit_id: str) -> Dict[str, int]:
+    """Return {"YYYY-MM-DD": completions} for a single habit."""
+    rows = await db[BUCKETS].aggregate([
+        {"$match": {"habit_id": habit_id}},
+        {"$unwind": "$events"},
+        {"$group": {"_id": EVENT_DAY, "count": {"$sum": 1}}},
+    ]).to_list(length=None)
+    return {row["_id"]: row["count"] for row in rows}
+
+
+async def completion_breakdown(db, user_id: str, start: date, end: date) -> Dict[str, Dict[str, int]]:
+    """
+    Count a user's completions in [start, end] per day and per habit in one aggregation.
+
+    Only the bucket months overlapping the range are scanned, and only the
+    counters ({"by_day": {date: n}, "by_habit": {habit_id: n}}) are returned.
+    """
+    rows = await db[BUCKETS].aggregate([
+        {"$match": _bucket_match(user_id, start, end)},
+        {"$unwind": "$events"},
+        {"$match": _event_match(start, end)},
+        {"$facet": {
+            "by_day": [{"$group": {"_id": EVENT_DAY, "count": {"$sum": 1}}}],
+            "by_habit": [{"$group": {"_id": "$habit_id", "count": {"$sum": 1}}}],
+        }},
+    ]).to_list(length=None)
+    facets = rows[0] if rows else {}
+    return {
+        name: {row["_id"]: row["count"] for row in facets.get(name, [])}
+        for name in ("by_day", "by_habit")
+    }
+
+
+async def migrate_legacy_completions(db) -> Dict[str, int]:
+    """
+    Move `habits.completion_history` arrays and `habit_completions` documents into buckets.
+
+    A habit is migrated once: its `completion_history` field is unset at the end,
+    so re-running the migration only picks up habits that were not processed yet.
+    Each month bucket is built in full from the legacy data and written with
+    replace_one, so a habit interrupted between its bucket writes and the unset
+    is rewritten to the same buckets on the next run instead of double-counted.
+    Full timestamps are taken from `habit_completions` where available.
+    """
+    migrated_habits = 0
+    migrated_events = 0
+
+    habits_cursor = db.habits.find(
+        {"completion_history": {"$exists": True}},
+        {"user_id": 1, "name": 1, "completion_history": 1},
+    )
+    async for habit in habits_cursor:
+        habit_id = str(habit["_id"])
+        user_id = habit.get("user_id")
+
+        # Full timestamps logged for AI analysis, keyed by day
+        timestamps: Dict[str, List[str]] = {}
+        async for c in db.habit_completions.find({"habit_id": habit_id}, {"date": 1, "completed_at": 1}):
+            day = c.get("date") or str(c.get("completed_at", ""))[:10]
+            if day:
+                timestamps.setdefault(day, []).append(c.get("completed_at"))
+
+        events_by_month: Dict[str, List[Dict[str, Any]]] = {}
+        for entry in habit.get("completion_history") or []:
+            day = entry.split("T")[0]
+            stamps = timestamps.get(day)
+            completed_at = stamps.pop(0) if stamps else None
+            events_by_month.setdefault(day[:7], []).append({"date": day, "completed_at": completed_at})
+
+        for month, events in events_by_month.items():
+            await db[BUCKETS].replace_one(
+                {"habit_id": habit_id, "month": month},
+                {
+                    "user_id": user_id,
+                    "habit_id": habit_id,
+                    "month": month,
+                    "habit_name": habit.get("name"),
+                    "count": len(events),
+                    "events": events,
+                },
+                upsert=True,
+            )
+            migrated_events += len(events)
+
+        await db.habits.update_one({"_id": habit["_id"]}, {"$unset": {"completion_history": ""}})
+        migrated_habits += 1
+
+    return {"habits": migrated_habits, "events": migrated_events}
+
+
+def _as_datetime(event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Convert a legacy {"date", "completed_at"} event into the {"at": datetime} form.
+
+    Returns None for an event with neither a parsable `completed_at` nor a valid `date`.
+    """
+    if "at" in event:
+        return event
+    completed_at = event.get("completed_at")
+    if isinstance(completed_at, datetime):
+        return {"at": completed_at}
+    if completed_at:
+        try:
+            parsed = datetime.fromisoformat(str(completed_at).replace("Z", "+00:00"))
+            return {"at": parsed.replace(tzinfo=None) - (parsed.utcoffset() or timedelta(0))}
+        except ValueError:
+            pass
+    try:
+        return {"at": day_start(date.fromisoformat(str(event.get("date") or completed_at or "")[:10])), "date_only": True}
+    except ValueError:
+        return None
+
+
+def _converted_events(bucket: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """A bucket's events in {"at": datetime} form; malformed events are logged and dropped."""
+    events = []
+    for event in bucket.get("events", []):
+        converted = _as_datetime(event)
+        if converted is None:
+            print(f"Dropping malformed completion event {event!r} from bucket {bucket['_id']}")
+            continue
+        events.append(converted)
+    return events
+
+
+async def backfill_datetimes(db, batch_size: int = 500) -> Dict[str, int]:
+    """
+    Convert legacy string timestamps to BSON datetimes in batches.
+
+    Bucket events become {"at": datetime} and `habits.last_completed` becomes
+    midnight UTC of the completion day. Both queries only match documents that
+    still hold strings, so the backfill can be interrupted and re-run safely.
+    A bucket that receives a new completion while being converted is skipped
+    by the `count` guard and picked up by the next pass. Events with no usable
+    timestamp or date are logged and dropped rather than failing the migration.
+    """
+    converted = {"buckets": 0, "habits": 0}
+
+    while True:
+        buckets = await db[BUCKETS].find(
+            {"events.completed_at": {"$exists": True}},
+            {"events": 1, "count": 1},
+        ).limit(batch_size).to_list(length=None)
+        if not buckets:
+            break
+        ops = []
+        for bucket in buckets:
+            events = _converted_events(bucket)
+            ops.append(UpdateOne(
+                {"_id": bucket["_id"], "count": bucket.get("count")},
+                {"$set": {"events": events, "count": len(events)}},
+            ))
+        result = await db[BUCKETS].bulk_write(ops, ordered=False)
+        converted["buckets"] += result.modified_count
+
+    while True:
+        habits = await db.habits.find(
+            {"last_completed": {"$type": "string"}},
+            {"last_completed": 1},
+        ).limit(batch_size).to_list(length=None)
+        if not habits:
+            break
+        ops = []
+        for habit in habits:
+            try:
+                value = day_start(date.fromisoformat(habit["last_completed"][:10]))
+            except ValueError:
+                value = None
+            ops.append(UpdateOne(
+                {"_id": habit["_id"], "last_completed": habit["last_completed"]},
+                {"$set": {"last_completed": value}},
+            ))
+        result = await db.habits.bulk_write(ops, ordered=False)
+        converted["habits"] += result.modified_count
+
+    return converted
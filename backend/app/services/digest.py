@@ -0,0 +1,42 @@
+from html import escape
+from string import Template
+from typing import Any, Dict, List, Tuple
+
+# Templates are compiled once at import and reused for every digest
+DIGEST_TEMPLATE = Template(
+    "<p>Hi $name,</p>"
+    "<p>Here's what's new with your habits:</p>"
+    "$sections"
+    "<p>Keep up the great work!</p>"
+)
+SECTION_TEMPLATE = Template("<h3>$title</h3><ul>$items</ul>")
+ITEM_TEMPLATE = Template("<li>$text</li>")
+
+# Section order and headings, by notification kind
+SECTIONS: List[Tuple[str, str]] = [
+    ("reminder", "Reminders"),
+    ("streak_alert", "Streak milestones"),
+    ("ai_insight", "Your AI insight"),
+]
+
+
+def digest_subject(notifications: List[Dict[str, Any]]) -> str:
+    return f"Your habit update: {len(notifications)} notifications"
+
+
+def render_digest(user_name: str, notifications: List[Dict[str, Any]]) -> str:
+    """Render several notifications for one user into a single HTML body, grouped by kind."""
+    by_kind: Dict[str, List[str]] = {}
+    for n in notifications:
+        by_kind.setdefault(n.get("kind"), []).append(n.get("summary") or n["subject"])
+
+    headings = dict(SECTIONS)
+    order = [kind for kind, _ in SECTIONS] + [kind for kind in by_kind if kind not in headings]
+    sections = "".join(
+        SECTION_TEMPLATE.substitute(
+            title=escape(headings.get(kind, "Other")),
+            items="".join(ITEM_TEMPLATE.substitute(text=escape(text)) for text in by_kind[kind]),
+        )
+        for kind in order if kind in by_kind
+    )
+    return DIGEST_TEMPLATE.substitute(name=escape(user_name or "there"), sections=sections)
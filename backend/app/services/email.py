@@ -1,27 +1,182 @@
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig
+import asyncio
+import time
+from dataclasses import dataclass, field
+from email.message import EmailMessage
+from email.utils import formataddr
+from typing import List, Optional, Union
+
+import aiosmtplib
+
 from app.core.config import settings
-from typing import List
-
-conf = ConnectionConfig(
-    MAIL_USERNAME=settings.MAIL_USERNAME,
-    MAIL_PASSWORD=settings.MAIL_PASSWORD,
-    MAIL_FROM=settings.MAIL_FROM,
-    MAIL_PORT=settings.MAIL_PORT,
-    MAIL_SERVER=settings.MAIL_SERVER,
-    MAIL_STARTTLS=settings.MAIL_STARTTLS,
-    MAIL_SSL_TLS=settings.MAIL_SSL_TLS,
-    USE_CREDENTIALS=settings.USE_CREDENTIALS,
-    VALIDATE_CERTS=settings.VALIDATE_CERTS,
-    MAIL_FROM_NAME=settings.MAIL_FROM_NAME
-)
-
-async def send_email(subject: str, recipients: List[str], body: str):
-    message = MessageSchema(
-        subject=subject,
-        recipients=recipients,
-        body=body,
-        subtype="html"
-    )
-
-    fm = FastMail(conf)
-    await fm.send_message(message)
\ No newline at end of file
+from app.core.metrics import EMAIL_SEND_LATENCY
+
+
+@dataclass
+class DeliveryResult:
+    recipients: List[str]
+    subject: str
+    ok: bool
+    error: Optional[str] = None
+    latency: float = 0.0
+
+
+@dataclass
+class _Job:
+    message: EmailMessage
+    future: asyncio.Future
+
+
+@dataclass
+class DeliveryStats:
+    sent: int = 0
+    failed: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def throughput(self) -> float:
+        """Messages delivered per second since the service started."""
+        elapsed = time.monotonic() - self.started_at
+        return self.sent / elapsed if elapsed > 0 else 0.0
+
+    def as_dict(self) -> dict:
+        return {"sent": self.sent, "failed": self.failed, "throughput": round(self.throughput, 3)}
+
+
+class MailDeliveryService:
+    """
+    Delivers mail over a small pool of persistent SMTP connections.
+
+    Messages are put on an in-process queue and drained by `pool_size` workers,
+    each owning one connection that is reused across messages, re-opened when
+    the server drops it and closed after `idle_timeout` seconds without work.
+    Every message resolves to a DeliveryResult; aggregate counts are in `stats`.
+    """
+
+    def __init__(self, pool_size: int, idle_timeout: float):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.stats = DeliveryStats()
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+
+    def _new_connection(self) -> aiosmtplib.SMTP:
+        return aiosmtplib.SMTP(
+            hostname=settings.MAIL_SERVER,
+            port=settings.MAIL_PORT,
+            use_tls=settings.MAIL_SSL_TLS,
+            start_tls=settings.MAIL_STARTTLS,
+            validate_certs=settings.VALIDATE_CERTS,
+        )
+
+    async def _connect(self, smtp: aiosmtplib.SMTP):
+        await smtp.connect()
+        if settings.USE_CREDENTIALS:
+            await smtp.login(settings.MAIL_USERNAME, settings.MAIL_PASSWORD)
+
+    async def _close(self, smtp: aiosmtplib.SMTP):
+        if smtp.is_connected:
+            try:
+                await smtp.quit()
+            except aiosmtplib.SMTPException:
+                smtp.close()
+
+    async def _deliver(self, smtp: aiosmtplib.SMTP, message: EmailMessage):
+        if not smtp.is_connected:
+            await self._connect(smtp)
+        try:
+            await smtp.send_message(message)
+        except aiosmtplib.SMTPServerDisconnected:
+            # The pooled connection went stale; reconnect once and retry
+            smtp.close()
+            await self._connect(smtp)
+            await smtp.send_message(message)
+
+    @staticmethod
+    def _result(message: EmailMessage, ok: bool = True, error: Optional[str] = None) -> DeliveryResult:
+        return DeliveryResult(
+            recipients=[addr.strip() for addr in message["To"].split(",")],
+            subject=message["Subject"],
+            ok=ok,
+            error=error,
+        )
+
+    def _abandon(self, job: _Job, error: str):
+        if not job.future.done():
+            job.future.set_result(self._result(job.message, ok=False, error=error))
+
+    async def _worker(self):
+        smtp = self._new_connection()
+        job: Optional[_Job] = None
+        try:
+            while True:
+                job = None
+                try:
+                    job = await asyncio.wait_for(self._queue.get(), timeout=self.idle_timeout)
+                except asyncio.TimeoutError:
+                    await self._close(smtp)
+                    continue
+
+                start = time.perf_counter()
+                result = self._result(job.message)
+                try:
+                    await self._deliver(smtp, job.message)
+                    self.stats.sent += 1
+                except Exception as e:
+                    result.ok = False
+                    result.error = str(e)
+                    self.stats.failed += 1
+                    smtp.close()
+                result.latency = time.perf_counter() - start
+                EMAIL_SEND_LATENCY.labels("ok" if result.ok else "error").observe(result.latency)
+                if not job.future.done():
+                    job.future.set_result(result)
+                self._queue.task_done()
+        finally:
+            if job is not None:
+                # Stopped mid-delivery: the server may or may not have accepted it
+                self._abandon(job, "Mail delivery service stopped during delivery")
+            await self._close(smtp)
+
+    def _ensure_started(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self.stats = DeliveryStats()
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.pool_size)]
+
+    async def submit(self, message: EmailMessage) -> asyncio.Future:
+        """Queue a message and return a future resolving to its DeliveryResult."""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_Job(message, future))
+        return future
+
+    async def deliver(self, messages: List[EmailMessage]) -> List[DeliveryResult]:
+        """Queue several messages and wait for all of their outcomes."""
+        futures = [await self.submit(message) for message in messages]
+        return list(await asyncio.gather(*futures))
+
+    async def stop(self):
+        """Stop the workers; every message not delivered yet resolves to a failed DeliveryResult."""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        if self._queue is not None:
+            while not self._queue.empty():
+                self._abandon(self._queue.get_nowait(), "Mail delivery service stopped before delivery")
+        self._workers = []
+        self._queue = None
+
+
+mailer = MailDeliveryService(pool_size=settings.MAIL_POOL_SIZE, idle_timeout=settings.MAIL_IDLE_TIMEOUT_SECONDS)
+
+
+def build_message(subject: str, recipients: Union[str, List[str]], body: str, subtype: str = "html") -> EmailMessage:
+    if isinstance(recipients, str):
+        recipients = [recipients]
+    message = EmailMessage()
+    message["Subject"] = subject
+    message["From"] = formataddr((settings.MAIL_FROM_NAME, settings.MAIL_FROM))
+    message["To"] = ", ".join(recipients)
+    message.set_content(body, subtype=subtype)
+    return message
+
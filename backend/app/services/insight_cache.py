@@ -0,0 +1,52 @@
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+
+# Generated /ai/insights responses, keyed by a fingerprint of the habit snapshot
+# the prompt is built from. One document per user: {"_id": user_id, "fingerprint",
+# "insights", "created_at", "expires_at"}; a TTL index on expires_at removes stale
+# entries. An in-process LRU sits in front of the collection.
+INSIGHT_CACHE_COLLECTION = "ai_insight_cache"
+
+_memory = TTLCache(maxsize=settings.INSIGHT_CACHE_MAX_SIZE, ttl=settings.INSIGHT_CACHE_TTL_SECONDS)
+
+
+def fingerprint(habits: List[Dict[str, Any]]) -> str:
+    """Hash the habit fields that feed the insights prompt (name, streak, completion rate, last completion)."""
+    snapshot = sorted(
+        (str(h.get("_id")), h.get("name", ""), h.get("streak", 0), h.get("completion_rate", 0),
+         str(h.get("last_completed") or "")[:10])
+        for h in habits
+    )
+    return hashlib.sha256(json.dumps(snapshot).encode()).hexdigest()
+
+
+async def get_cached_insights(db, user_id: str, fp: str) -> Optional[List[Dict[str, Any]]]:
+    insights = _memory.get((user_id, fp))
+    if insights is not None:
+        return insights
+
+    doc = await db[INSIGHT_CACHE_COLLECTION].find_one({"_id": user_id, "fingerprint": fp})
+    if doc is None or doc["expires_at"] <= datetime.utcnow():
+        return None
+    _memory.set((user_id, fp), doc["insights"], ttl=(doc["expires_at"] - datetime.utcnow()).total_seconds())
+    return doc["insights"]
+
+
+async def store_insights(db, user_id: str, fp: str, insights: List[Dict[str, Any]]):
+    now = datetime.utcnow()
+    _memory.set((user_id, fp), insights)
+    await db[INSIGHT_CACHE_COLLECTION].replace_one(
+        {"_id": user_id},
+        {
+            "fingerprint": fp,
+            "insights": insights,
+            "created_at": now,
+            "expires_at": now + timedelta(seconds=settings.INSIGHT_CACHE_TTL_SECONDS),
+        },
+        upsert=True,
+    )
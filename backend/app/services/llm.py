@@ -0,0 +1,298 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+import google.generativeai as genai
+
+from app.core.config import settings
+
+# Single entry point for Gemini calls from routers and background services.
+# Calls use the SDK's native async API so they never block the event loop, share
+# one GenerativeModel per model name, and are bounded by a process-wide
+# concurrency limit, a per-call deadline, the remaining deadline budget of the
+# current request, and a circuit breaker that fails calls fast while Gemini is
+# erroring or slow.
+genai.configure(api_key=settings.GEMINI_API_KEY)
+
+_models: Dict[str, genai.GenerativeModel] = {}
+_semaphore: Optional[asyncio.Semaphore] = None
+
+
+class LLMError(Exception):
+    """Raised when a Gemini call fails or returns no usable text."""
+
+
+class LLMTimeoutError(LLMError):
+    """Raised when a Gemini call does not finish within its deadline."""
+
+
+class CircuitOpenError(LLMError):
+    """Raised without calling Gemini while the circuit breaker is open."""
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Tracks Gemini call outcomes over a rolling window and stops calls while it is unhealthy.
+
+    The breaker opens when, over at least `min_calls` calls in the last `window`
+    seconds, the share of failed or slow calls reaches `failure_rate`. While
+    open, calls fail immediately with CircuitOpenError. After `open_seconds` it
+    turns half-open and lets a single probe call through: a healthy probe
+    closes it, anything else opens it again.
+    """
+
+    def __init__(self, window: float, min_calls: int, failure_rate: float, slow_seconds: float, open_seconds: float):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_seconds = slow_seconds
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        # (finished at, healthy) per call, oldest first
+        self._calls: Deque[Tuple[float, bool]] = deque()
+
+    def retry_after(self) -> float:
+        return max(0.0, self._opened_at + self.open_seconds - time.monotonic())
+
+    def rejecting(self) -> bool:
+        """Whether a call made now would be refused, without claiming the half-open probe slot."""
+        if self.state == OPEN:
+            return self.retry_after() > 0
+        return self.state == HALF_OPEN and self._probing
+
+    def allow(self) -> bool:
+        """Whether a call may go out now; in half-open state, claims the single probe slot."""
+        if self.state == OPEN:
+            if self.retry_after() > 0:
+                return False
+            self.state = HALF_OPEN
+            self._probing = False
+        if self.state == HALF_OPEN:
+            if self._probing:
+                return False
+            self._probing = True
+        return True
+
+    def release(self):
+        """Give back a half-open probe slot for a call that ended without an outcome (e.g. cancelled)."""
+        if self.state == HALF_OPEN:
+            self._probing = False
+
+    def record(self, ok: bool, latency: float):
+        now = time.monotonic()
+        healthy = ok and latency < self.slow_seconds
+        if self.state == HALF_OPEN:
+            self._probing = False
+            if healthy:
+                self.state = CLOSED
+                self._calls.clear()
+            else:
+                self._open(now)
+            return
+
+        self._calls.append((now, healthy))
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._calls.popleft()
+        if self.state == CLOSED and len(self._calls) >= self.min_calls:
+            unhealthy = sum(1 for _, h in self._calls if not h)
+            if unhealthy / len(self._calls) >= self.failure_rate:
+                self._open(now)
+
+    def _open(self, now: float):
+        print(f"Gemini circuit breaker opened for {self.open_seconds}s")
+        self.state = OPEN
+        self._opened_at = now
+        self._calls.clear()
+
+
+breaker = CircuitBreaker(
+    window=settings.LLM_BREAKER_WINDOW_SECONDS,
+    min_calls=settings.LLM_BREAKER_MIN_CALLS,
+    failure_rate=settings.LLM_BREAKER_FAILURE_RATE,
+    slow_seconds=settings.LLM_BREAKER_SLOW_SECONDS,
+    open_seconds=settings.LLM_BREAKER_OPEN_SECONDS,
+)
+
+# Monotonic time by which the current request must be done with Gemini
+_deadline: ContextVar[Optional[float]] = ContextVar("llm_deadline", default=None)
+
+
+@contextmanager
+def deadline(seconds: float):
+    """Give every Gemini call made inside the block a shared time budget of `seconds`."""
+    previous = _deadline.get()
+    _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.set(previous)
+
+
+def _budget(timeout: Optional[float]) -> float:
+    """The per-call timeout, cut down to what is left of the request's deadline budget."""
+    timeout = settings.LLM_TIMEOUT_SECONDS if timeout is None else timeout
+    ends_at = _deadline.get()
+    if ends_at is None:
+        return timeout
+    remaining = ends_at - time.monotonic()
+    if remaining <= 0:
+        raise LLMTimeoutError("Request deadline budget exhausted before calling Gemini")
+    return min(timeout, remaining)
+
+
+def _admit():
+    if not breaker.allow():
+        raise CircuitOpenError(f"Gemini circuit open, retry in {int(breaker.retry_after()) + 1}s")
+
+
+def get_model(name: Optional[str] = None) -> genai.GenerativeModel:
+    name = name or settings.LLM_MODEL
+    model = _models.get(name)
+    if model is None:
+        model = _models[name] = genai.GenerativeModel(name)
+    return model
+
+
+def _limiter() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY)
+    return _semaphore
+
+
+def _record_timeout(upstream_started: Optional[float]):
+    """
+    Report a timed-out call to the breaker. Only time Gemini itself spent counts:
+    a call that never got a concurrency slot, or whose request budget ran out
+    before Gemini had been slow, says nothing about Gemini's health.
+    """
+    elapsed = None if upstream_started is None else time.perf_counter() - upstream_started
+    if elapsed is not None and elapsed >= breaker.slow_seconds:
+        breaker.record(False, elapsed)
+    else:
+        breaker.release()
+
+
+async def _call(coro_factory, timeout: Optional[float]):
+    timeout = _budget(timeout)
+    _admit()
+    upstream_started: Optional[float] = None
+
+    async def run():
+        nonlocal upstream_started
+        async with _limiter():
+            upstream_started = time.perf_counter()
+            return await coro_factory()
+
+    try:
+        # The deadline covers waiting for a slot as well as the call itself
+        response = await asyncio.wait_for(run(), timeout=timeout)
+    except asyncio.TimeoutError:
+        _record_timeout(upstream_started)
+        raise LLMTimeoutError(f"Gemini call exceeded {timeout}s deadline")
+    except asyncio.CancelledError:
+        # The caller went away; says nothing about Gemini's health
+        breaker.release()
+        raise
+    except Exception as e:
+        breaker.record(False, time.perf_counter() - upstream_started)
+        if isinstance(e, LLMError):
+            raise
+        raise LLMError(str(e)) from e
+    # Gemini answered; a blocked or empty response below is not a provider failure
+    breaker.record(True, time.perf_counter() - upstream_started)
+
+    try:
+        return response.text
+    except ValueError as e:
+        # Raised by the SDK when the response was blocked or has no text part
+        raise LLMError(str(e)) from e
+
+
+async def generate(prompt: str, model: Optional[str] = None, timeout: Optional[float] = None,
+                   generation_config: Optional[dict] = None) -> str:
+    """Generate text for a single prompt and return it."""
+    return await _call(
+        lambda: get_model(model).generate_content_async(prompt, generation_config=generation_config),
+        timeout
+    )
+
+
+async def chat(message: str, history: List[dict], model: Optional[str] = None, timeout: Optional[float] = None) -> str:
+    """Send `message` in a chat seeded with Gemini-format `history` and return the reply text."""
+    session = get_model(model).start_chat(history=history)
+    return await _call(lambda: session.send_message_async(message), timeout)
+
+
+async def chat_stream(message: str, history: List[dict], model: Optional[str] = None,
+                      timeout: Optional[float] = None) -> AsyncIterator[str]:
+    """
+    Like `chat`, but yield the reply text chunk by chunk as Gemini produces it.
+
+    The next chunk is only requested once the caller consumed the previous one,
+    and closing the generator closes the upstream stream. The deadline applies to
+    getting a concurrency slot and to each wait for a chunk, not to the whole reply.
+    """
+    timeout = settings.LLM_TIMEOUT_SECONDS if timeout is None else timeout
+    _admit()
+    session = get_model(model).start_chat(history=history)
+    try:
+        await asyncio.wait_for(_limiter().acquire(), timeout=timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+        # Never reached Gemini: no verdict on its health
+        breaker.release()
+        if isinstance(e, asyncio.CancelledError):
+            raise
+        raise LLMTimeoutError(f"No Gemini slot free within {timeout}s")
+
+    started = time.perf_counter()
+
+    chunks = None
+    # The breaker judges the stream by its first chunk
+    recorded = failed = False
+    try:
+        response = await asyncio.wait_for(session.send_message_async(message, stream=True), timeout=timeout)
+        chunks = response.__aiter__()
+        while True:
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), timeout=timeout)
+            except StopAsyncIteration:
+                return
+            if not recorded:
+                breaker.record(True, time.perf_counter() - started)
+                recorded = True
+            try:
+                text = chunk.text
+            except ValueError as e:
+                raise LLMError(str(e)) from e
+            if text:
+                yield text
+    except asyncio.TimeoutError:
+        failed = True
+        raise LLMTimeoutError(f"Gemini stream stalled for more than {timeout}s")
+    except LLMError:
+        failed = True
+        raise
+    except Exception as e:
+        failed = True
+        raise LLMError(str(e)) from e
+    finally:
+        if not recorded and failed:
+            breaker.record(False, time.perf_counter() - started)
+        elif not recorded:
+            # Closed by the caller or ended before the first chunk
+            breaker.release()
+        _limiter().release()
+        if chunks is not None and hasattr(chunks, "aclose"):
+            # Stops the upstream stream when the caller gave up early
+            await chunks.aclose()
@@ -0,0 +1,210 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from app.core.config import settings
+from app.core.database import get_db
+from app.services.digest import digest_subject, render_digest
+from app.services.email import build_message, mailer
+
+# Notifications waiting for delivery, keyed by a deterministic idempotency key
+# (e.g. "streak:<habit_id>:<streak>:<day>"), so the same notification can only
+# ever be enqueued once across restarts and workers:
+# {"_id": key, "kind", "user_id", "user_name", "recipients", "subject", "body",
+#  "summary", "status",
+#  "attempts", "next_attempt_at", "claim_id", "claimed_at", "last_error",
+#  "created_at", "sent_at", "expires_at"}
+# status is pending -> sending -> sent, or dead after OUTBOX_MAX_ATTEMPTS failures.
+# Sent and dead entries are kept as the idempotency ledger until expires_at.
+# Notifications of one user that are due together go out as a single digest.
+OUTBOX_COLLECTION = "notification_outbox"
+
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+DEAD = "dead"
+
+# A "sending" claim older than this belongs to a dispatcher that died mid-batch
+STALE_CLAIM_AFTER = timedelta(minutes=10)
+LEDGER_RETENTION = timedelta(days=90)
+
+# Extra in-process dispatches requested by producers, keyed by when they run,
+# and every such task still running
+_wakeups: Dict[datetime, asyncio.Task] = {}
+_tasks: Set[asyncio.Task] = set()
+
+
+
+def reminder_key(habit_id: str, day: str) -> str:
+    return f"reminder:{habit_id}:{day}"
+
+
+def streak_key(habit_id: str, streak: int, day: str) -> str:
+    return f"streak:{habit_id}:{streak}:{day}"
+
+
+def insight_key(user_id: str, run_id: str) -> str:
+    return f"insight:{user_id}:{run_id}"
+
+
+def notification(key: str, kind: str, user_id: Optional[str], recipients: List[str], subject: str, body: str,
+                 summary: Optional[str] = None, user_name: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Build an outbox entry. `summary` is the one-line form used when the entry is
+    merged into a digest. Entries are held for NOTIFICATION_DIGEST_WINDOW_SECONDS
+    so that other notifications of the same user can join the digest.
+    """
+    now = datetime.utcnow()
+    return {
+        "_id": key,
+        "kind": kind,
+        "user_id": user_id,
+        "user_name": user_name,
+        "recipients": recipients,
+        "subject": subject,
+        "body": body,
+        "summary": summary,
+        "status": PENDING,
+        "attempts": 0,
+        "next_attempt_at": now + timedelta(seconds=settings.NOTIFICATION_DIGEST_WINDOW_SECONDS),
+        "created_at": now,
+    }
+
+
+async def enqueue(db, notifications: List[Dict[str, Any]]) -> int:
+    """Insert notifications, ignoring keys that were already enqueued; returns how many are new."""
+    if not notifications:
+        return 0
+    try:
+        result = await db[OUTBOX_COLLECTION].insert_many(notifications, ordered=False)
+        return len(result.inserted_ids)
+    except BulkWriteError as e:
+        # Duplicate keys are expected: the notification was already enqueued
+        other = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+        if other:
+            raise
+        return e.details.get("nInserted", 0)
+    except DuplicateKeyError:
+        return 0
+
+
+def _group_messages(batch: List[Dict[str, Any]]) -> List[Tuple[EmailMessage, List[Dict[str, Any]]]]:
+    """One message per user: single notifications as they are, several as one digest."""
+    groups: Dict[Any, List[Dict[str, Any]]] = {}
+    for doc in batch:
+        groups.setdefault(doc.get("user_id") or doc["_id"], []).append(doc)
+
+    messages = []
+    for docs in groups.values():
+        if len(docs) == 1:
+            message = build_message(docs[0]["subject"], docs[0]["recipients"], docs[0]["body"])
+        else:
+            message = build_message(digest_subject(docs), docs[0]["recipients"],
+                                    render_digest(docs[0].get("user_name"), docs))
+        messages.append((message, docs))
+    return messages
+
+
+def _backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(settings.OUTBOX_BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), settings.OUTBOX_BACKOFF_MAX_SECONDS))
+
+
+def _outcome_update(doc: Dict[str, Any], result, now: datetime, outcome: Dict[str, int]) -> UpdateOne:
+    if result.ok:
+        outcome["sent"] += 1
+        update = {"status": SENT, "sent_at": now, "expires_at": now + LEDGER_RETENTION}
+    else:
+        attempts = doc.get("attempts", 0) + 1
+        if attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+            outcome["dead"] += 1
+            print(f"Dead-lettering notification {doc['_id']}: {result.error}")
+            update = {"status": DEAD, "attempts": attempts, "last_error": result.error,
+                      "expires_at": now + LEDGER_RETENTION}
+        else:
+            outcome["retried"] += 1
+            update = {"status": PENDING, "attempts": attempts, "last_error": result.error,
+                      "next_attempt_at": now + _backoff(attempts)}
+    return UpdateOne({"_id": doc["_id"], "claim_id": doc["claim_id"]}, {"$set": update})
+
+
+async def _claim_batch(db, limit: int) -> List[Dict[str, Any]]:
+    now = datetime.utcnow()
+    due = {"$or": [
+        {"status": PENDING, "next_attempt_at": {"$lte": now}},
+        {"status": SENDING, "claimed_at": {"$lt": now - STALE_CLAIM_AFTER}},
+    ]}
+    found = await db[OUTBOX_COLLECTION].find(due, {"user_id": 1}).limit(limit).to_list(length=None)
+    if not found:
+        return []
+
+    # Claim every due entry of the users found, plus those still held for the digest
+    # window (never attempted), so each user's digest is complete and a user's
+    # notifications enqueued within one window go out together.
+    # The fresh claim id means a concurrent dispatcher can only claim documents we didn't.
+    ids = [doc["_id"] for doc in found]
+    user_ids = list({doc["user_id"] for doc in found if doc.get("user_id")})
+    joinable = {"$or": [*due["$or"], {"status": PENDING, "attempts": 0}]}
+    claim_id = uuid.uuid4().hex
+    await db[OUTBOX_COLLECTION].update_many(
+        {"$and": [joinable, {"$or": [{"_id": {"$in": ids}}, {"user_id": {"$in": user_ids}}]}]},
+        {"$set": {"status": SENDING, "claim_id": claim_id, "claimed_at": now}},
+    )
+    return await db[OUTBOX_COLLECTION].find({"claim_id": claim_id, "status": SENDING}).to_list(length=None)
+
+
+async def dispatch_outbox(db) -> Dict[str, int]:
+    """Deliver due notifications until the outbox is drained, retrying failures with exponential backoff."""
+    outcome = {"sent": 0, "retried": 0, "dead": 0, "emails": 0}
+    while True:
+        batch = await _claim_batch(db, settings.OUTBOX_BATCH_SIZE)
+        if not batch:
+            return outcome
+
+        grouped = _group_messages(batch)
+        results = await mailer.deliver([message for message, _ in grouped])
+        outcome["emails"] += len(results)
+        now = datetime.utcnow()
+        updates = []
+        for (_, docs), result in zip(grouped, results):
+            for doc in docs:
+                updates.append(_outcome_update(doc, result, now, outcome))
+        await db[OUTBOX_COLLECTION].bulk_write(updates, ordered=False)
+
+
+async def _dispatch_at(db, at: datetime):
+    await asyncio.sleep(max(0.0, (at - datetime.utcnow()).total_seconds()))
+    # Requests arriving from now on need a dispatch of their own
+    _wakeups.pop(at, None)
+    try:
+        outcome = await dispatch_outbox(db)
+        if any(outcome.values()):
+            print(f"Notification outbox: {outcome}")
+    except Exception as e:
+        print(f"Error dispatching notification outbox: {e}")
+
+
+def dispatch_soon(db, due_at: datetime):
+    """
+    Dispatch the outbox in this worker once `due_at` has passed, rather than on
+    the next dispatch_notifications run. Requests for the same second share one
+    dispatch; the cron job remains the fallback and handles retries.
+    """
+    at = due_at.replace(microsecond=0) + timedelta(seconds=1 if due_at.microsecond else 0)
+    if at in _wakeups:
+        return
+    task = asyncio.create_task(_dispatch_at(db, at))
+    _wakeups[at] = task
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def dispatch_notifications():
+    """Background job draining the outbox."""
+    outcome = await dispatch_outbox(await get_db())
+    if any(outcome.values()):
+        print(f"Notification outbox: {outcome}")
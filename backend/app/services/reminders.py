@@ -1,26 +1,219 @@
-from app.core.database import get_db
-from app.services.email import send_email
+import asyncio
+import heapq
 from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
 
-async def check_and_send_reminders():
-    db = await get_db()
-    now = datetime.utcnow()
-    # Find habits that have reminders enabled and are due for a reminder
-    habits_cursor = db.habits.find({
-        "reminder_enabled": True,
-        "next_reminder_at": {"$lte": now}
-    })
-    async for habit in habits_cursor:
-        user = await db.users.find_one({"_id": habit["user_id"]})
-        if user and user.settings.notifications and user.settings.habitReminders:
-            await send_email(
-                subject=f"Reminder: {habit['name']}",
-                recipients=[user["email"]],
-                body=f"<p>Hi {user['name']},</p><p>This is a reminder to complete your habit: <strong>{habit['name']}</strong>.</p>"
-            )
-            # Update the next reminder time
-            next_reminder_at = now + timedelta(days=1) # Assuming daily reminders for now
-            await db.habits.update_one(
-                {"_id": habit["_id"]},
-                {"$set": {"next_reminder_at": next_reminder_at}}
-            )
\ No newline at end of file
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from app.core.config import settings
+from app.core.metrics import track_task
+from app.core.scheduler import DEFAULT_LEASE_SECONDS, hold_lease
+from app.services import outbox
+
+# Users and their due habits are flushed in chunks so a large backlog of due
+# reminders never has to be held in memory at once
+REMINDER_FLUSH_SIZE = 1000
+
+# A reminder that failed to go out is retried this much later
+REMINDER_RETRY = timedelta(seconds=60)
+
+# Only the worker holding this lease loads reminder windows from the database;
+# it renews the lease, and the others try to take it over, every third of its lifetime
+REMINDER_LEASE = "reminder_timer"
+REMINDER_LEASE_RENEW = timedelta(seconds=DEFAULT_LEASE_SECONDS / 3)
+
+
+def due_reminders_pipeline(now: datetime, habit_ids: List[ObjectId]) -> list:
+    """The due habits among `habit_ids` joined with their owner, grouped per user."""
+    return [
+        {"$match": {"_id": {"$in": habit_ids}, "reminder_enabled": True, "next_reminder_at": {"$lte": now}}},
+        {"$project": {"name": 1, "user_oid": {"$convert": {"input": "$user_id", "to": "objectId", "onError": None}}}},
+        {"$lookup": {
+            "from": "users",
+            "localField": "user_oid",
+            "foreignField": "_id",
+            "pipeline": [{"$project": {"email": 1, "name": 1, "settings": 1}}],
+            "as": "user",
+        }},
+        {"$unwind": {"path": "$user", "preserveNullAndEmptyArrays": True}},
+        {"$group": {
+            "_id": "$user_oid",
+            "email": {"$first": "$user.email"},
+            "name": {"$first": "$user.name"},
+            "opted_in": {"$first": {"$and": [
+                {"$eq": ["$user.settings.notifications", True]},
+                {"$eq": ["$user.settings.habitReminders", True]},
+            ]}},
+            "habits": {"$push": {"_id": "$_id", "name": "$name"}},
+        }},
+    ]
+
+
+async def _flush(db, notifications: list, reschedule: list):
+    # Enqueued before rescheduling: a crash in between re-enqueues the same
+    # idempotency keys on the next attempt, which is a no-op
+    if await outbox.enqueue(db, notifications):
+        # Deliver now instead of on the next dispatch_notifications run
+        outbox.dispatch_soon(db, max(n["next_attempt_at"] for n in notifications))
+    if reschedule:
+        await db.habits.bulk_write(reschedule, ordered=False)
+
+
+async def send_due_reminders(db, now: datetime, habit_ids: List[ObjectId]):
+    """Enqueue reminders for those of `habit_ids` still due in the database and reschedule them."""
+    # Assuming daily reminders for now
+    next_reminder_at = now + timedelta(days=1)
+    day = now.strftime("%Y-%m-%d")
+
+    notifications = []
+    reschedule = []
+    # Due habits are rescheduled whether or not the owner is opted in, so habits of
+    # opted-out users don't fire again
+    async for group in db.habits.aggregate(due_reminders_pipeline(now, habit_ids)):
+        for habit in group["habits"]:
+            if group.get("opted_in") and group.get("email"):
+                notifications.append(outbox.notification(
+                    outbox.reminder_key(str(habit["_id"]), day),
+                    kind="reminder",
+                    user_id=str(group["_id"]),
+                    recipients=[group["email"]],
+                    subject=f"Reminder: {habit['name']}",
+                    body=f"<p>Hi {group.get('name') or 'there'},</p><p>This is a reminder to complete your habit: <strong>{habit['name']}</strong>.</p>",
+                    summary=f"Complete your habit: {habit['name']}",
+                    user_name=group.get("name"),
+                ))
+            reschedule.append(UpdateOne({"_id": habit["_id"]}, {"$set": {"next_reminder_at": next_reminder_at}}))
+
+        if len(reschedule) >= REMINDER_FLUSH_SIZE:
+            await _flush(db, notifications, reschedule)
+            notifications, reschedule = [], []
+
+    await _flush(db, notifications, reschedule)
+
+
+class ReminderTimer:
+    """
+    Fires habit reminders at their exact `next_reminder_at`.
+
+    Upcoming reminders sit in an in-memory min-heap. Only a window of
+    REMINDER_WINDOW_SECONDS is held. The worker holding the REMINDER_LEASE
+    lease loads it from the reminder_due index when it becomes leader and again
+    before the window runs out; the other workers only wait to take the lease
+    over. In every worker, the habits router adds the reminders it sets within
+    the window through `schedule`, so a reminder moved to the next few minutes
+    fires on time whichever worker handled the request. Between those, the
+    timer sleeps until the earliest reminder is due or the lease needs renewing.
+
+    Heap entries are hints; the database stays the source of truth. A fired
+    entry only sends for habits that are still enabled and due, so a reminder
+    disabled or moved through another worker is simply a no-op here, and the
+    outbox idempotency key keeps two workers firing the same reminder from
+    emailing twice.
+    """
+
+    def __init__(self, window: timedelta):
+        self.window = window
+        self._heap: List[Tuple[datetime, ObjectId]] = []
+        # Current due time per habit; heap entries that disagree are stale
+        self._due: Dict[ObjectId, datetime] = {}
+        self._loaded_until = datetime.min
+        self._leader = False
+        self._renew_at = datetime.min
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def schedule(self, habit_id: ObjectId, due_at: Optional[datetime]):
+        """Set, move, or (with None) cancel the reminder of a habit."""
+        if due_at is None or due_at >= datetime.utcnow() + self.window:
+            # Beyond the window: picked up by a later window load
+            self._due.pop(habit_id, None)
+            return
+        self._due[habit_id] = due_at
+        heapq.heappush(self._heap, (due_at, habit_id))
+        if self._wakeup is not None and self._heap[0] == (due_at, habit_id):
+            self._wakeup.set()
+
+    def _prune(self):
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def _pop_due(self, now: datetime) -> List[ObjectId]:
+        due = []
+        self._prune()
+        while self._heap and self._heap[0][0] <= now:
+            _, habit_id = heapq.heappop(self._heap)
+            del self._due[habit_id]
+            due.append(habit_id)
+            self._prune()
+        return due
+
+    async def _load(self, db, now: datetime):
+        loaded_until = now + self.window
+        cursor = db.habits.find(
+            {"reminder_enabled": True, "next_reminder_at": {"$lt": loaded_until}},
+            {"next_reminder_at": 1},
+        )
+        async for habit in cursor:
+            self.schedule(habit["_id"], habit["next_reminder_at"])
+        self._loaded_until = loaded_until
+
+    async def _lead(self, db, now: datetime):
+        """Renew or take over the lease, and as leader load the next window before the current one runs out."""
+        self._renew_at = now + REMINDER_LEASE_RENEW
+        try:
+            leader = await hold_lease(db, REMINDER_LEASE, DEFAULT_LEASE_SECONDS)
+        except Exception as e:
+            print(f"Error renewing reminder timer lease: {e}")
+            leader = False
+        if not leader:
+            if self._leader:
+                print("Lost reminder timer lease")
+            self._leader = False
+            self._loaded_until = datetime.min
+            return
+
+        if not self._leader:
+            print("Took over the reminder timer lease")
+            self._leader = True
+        if now + REMINDER_LEASE_RENEW >= self._loaded_until:
+            try:
+                await self._load(db, now)
+            except Exception as e:
+                # Retried at the next renewal
+                print(f"Error loading reminders: {e}")
+
+    async def _fire(self, db, now: datetime, habit_ids: List[ObjectId]):
+        for i in range(0, len(habit_ids), REMINDER_FLUSH_SIZE):
+            chunk = habit_ids[i:i + REMINDER_FLUSH_SIZE]
+            try:
+                async with track_task("schedule_reminders"):
+                    await send_due_reminders(db, now, chunk)
+            except Exception as e:
+                print(f"Error sending reminders: {e}")
+                for habit_id in chunk:
+                    self.schedule(habit_id, now + REMINDER_RETRY)
+
+    async def run(self, get_db):
+        """Background loop sleeping until the next reminder or lease renewal, whichever comes first."""
+        db = await get_db()
+        self._wakeup = asyncio.Event()
+        while True:
+            now = datetime.utcnow()
+            if now >= self._renew_at:
+                await self._lead(db, now)
+
+            due = self._pop_due(now)
+            if due:
+                await self._fire(db, now, due)
+                continue
+
+            self._wakeup.clear()
+            self._prune()
+            wake_at = min(self._heap[0][0], self._renew_at) if self._heap else self._renew_at
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(0.0, (wake_at - now).total_seconds()))
+            except asyncio.TimeoutError:
+                pass
+
+
+reminder_timer = ReminderTimer(window=timedelta(seconds=settings.REMINDER_WINDOW_SECONDS))
@@ -0,0 +1,128 @@
+import math
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# Reminder-time suggestions computed locally from completion timestamps. Pure
+# functions only: no database or network access.
+
+MINUTES_PER_DAY = 24 * 60
+WEEKDAY_NAMES = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+# Fewer completions than this are not a pattern
+MIN_COMPLETIONS = 3
+# Mean resultant length (0 = spread over the day, 1 = always the same minute)
+# from which completion times count as clustered around their circular mean
+CONCENTRATION_THRESHOLD = 0.6
+# Share of completions in the busiest hour from which that hour is a clear
+# pattern on its own, e.g. a habit done mornings and some evenings
+MODE_SHARE_THRESHOLD = 0.5
+# Weekdays covering this share of completions are mentioned, if they are few
+WEEKDAY_SHARE_THRESHOLD = 0.8
+MAX_NOTABLE_WEEKDAYS = 4
+MIN_WEEKDAY_COMPLETIONS = 7
+
+REMINDER_LEAD_MINUTES = 30
+
+# Only completions this recent are analyzed: they reflect the current routine
+# and keep the query to a few bucket months per habit
+HISTORY_DAYS = 90
+
+REASON_TEMPLATES = {
+    "mean": "You usually complete this around {usual} ({count} completions), so a reminder at {suggested} gives you a {lead}-minute head start.",
+    "mode": "Most of your completions ({share}%) happen between {usual} and {usual_end}, so a reminder at {suggested} lands just before.",
+}
+WEEKDAY_TEMPLATE = " You mostly do it on {days}."
+
+
+@dataclass
+class TimePattern:
+    count: int
+    mean_minute: int
+    concentration: float
+    mode_hour: int
+    mode_share: float
+    weekdays: List[int]
+
+
+def format_minute(minute: int) -> str:
+    minute %= MINUTES_PER_DAY
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+def circular_mean(minutes: List[int]) -> tuple:
+    """Return (mean minute of day, mean resultant length) treating the day as a circle, so 23:30 and 00:30 average to 00:00."""
+    angles = [2 * math.pi * m / MINUTES_PER_DAY for m in minutes]
+    x = sum(math.cos(a) for a in angles) / len(angles)
+    y = sum(math.sin(a) for a in angles) / len(angles)
+    mean = round(math.atan2(y, x) / (2 * math.pi) * MINUTES_PER_DAY) % MINUTES_PER_DAY
+    return mean, math.hypot(x, y)
+
+
+def notable_weekdays(days: List[int]) -> List[int]:
+    """The fewest weekdays covering WEEKDAY_SHARE_THRESHOLD of completions, or [] if that takes too many."""
+    if len(days) < MIN_WEEKDAY_COMPLETIONS:
+        return []
+    counts = Counter(days)
+    covered = 0
+    notable = []
+    for day, count in counts.most_common():
+        notable.append(day)
+        covered += count
+        if covered / len(days) >= WEEKDAY_SHARE_THRESHOLD:
+            break
+    return sorted(notable) if len(notable) <= MAX_NOTABLE_WEEKDAYS else []
+
+
+def analyze(times: List[datetime]) -> Optional[TimePattern]:
+    if len(times) < MIN_COMPLETIONS:
+        return None
+    minutes = [t.hour * 60 + t.minute for t in times]
+    mean_minute, concentration = circular_mean(minutes)
+    mode_hour, mode_count = Counter(t.hour for t in times).most_common(1)[0]
+    return TimePattern(
+        count=len(times),
+        mean_minute=mean_minute,
+        concentration=concentration,
+        mode_hour=mode_hour,
+        mode_share=mode_count / len(times),
+        weekdays=notable_weekdays([t.weekday() for t in times]),
+    )
+
+
+def suggest_reminder(habit_id: str, habit_name: str, times: List[datetime],
+                     current_time: Optional[str] = None) -> Optional[Dict[str, Optional[str]]]:
+    """Suggest a reminder time for one habit, or None when its completions show no clear pattern."""
+    pattern = analyze(times)
+    if pattern is None:
+        return None
+
+    if pattern.concentration >= CONCENTRATION_THRESHOLD:
+        usual = pattern.mean_minute
+        reason = REASON_TEMPLATES["mean"]
+    elif pattern.mode_share >= MODE_SHARE_THRESHOLD:
+        usual = pattern.mode_hour * 60
+        reason = REASON_TEMPLATES["mode"]
+    else:
+        return None
+
+    suggested = usual - REMINDER_LEAD_MINUTES
+    reason = reason.format(
+        usual=format_minute(usual),
+        usual_end=format_minute(usual + 60),
+        suggested=format_minute(suggested),
+        count=pattern.count,
+        share=round(pattern.mode_share * 100),
+        lead=REMINDER_LEAD_MINUTES,
+    )
+    if pattern.weekdays and len(pattern.weekdays) < len(WEEKDAY_NAMES):
+        reason += WEEKDAY_TEMPLATE.format(days=", ".join(WEEKDAY_NAMES[d] for d in pattern.weekdays))
+
+    return {
+        "habit_id": habit_id,
+        "habit_name": habit_name,
+        "current_time": current_time,
+        "suggested_time": format_minute(suggested),
+        "reason": reason,
+    }
@@ -0,0 +1,123 @@
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from app.services import completions
+
+# One rollup document per user, keyed by user id:
+# {"_id": user_id, "total_habits", "total_completions",
+#  "daily": {"YYYY-MM-DD": n}, "habit_totals": {habit_id: n},
+#  "habit_streaks": {habit_id: streak}, "frequency": {frequency: n}, "built_at"}
+# The dashboard endpoints read it in a single lookup. Incremental updates never
+# upsert: a missing rollup is rebuilt from raw data on the next read.
+ROLLUPS = "user_stats"
+
+
+def _key(value: str) -> str:
+    """Make a user-provided value safe to use as a field name."""
+    return str(value).replace(".", "_").lstrip("$") or "unknown"
+
+
+async def on_habit_created(db, user_id: str, habit_id: str, frequency: str):
+    await db[ROLLUPS].update_one(
+        {"_id": user_id},
+        {
+            "$inc": {"total_habits": 1, f"frequency.{_key(frequency)}": 1},
+            "$set": {f"habit_totals.{habit_id}": 0, f"habit_streaks.{habit_id}": 0},
+        },
+    )
+
+
+async def on_frequency_changed(db, user_id: str, old_frequency: str, new_frequency: str):
+    if _key(old_frequency) == _key(new_frequency):
+        return
+    await db[ROLLUPS].update_one(
+        {"_id": user_id},
+        {"$inc": {f"frequency.{_key(old_frequency)}": -1, f"frequency.{_key(new_frequency)}": 1}},
+    )
+
+
+async def on_habit_deleted(db, user_id: str, habit_id: str, frequency: str, day_counts: Dict[str, int]):
+    """Remove a habit's contribution; `day_counts` are the habit's completions per day."""
+    inc = {"total_habits": -1, f"frequency.{_key(frequency)}": -1, "total_completions": -sum(day_counts.values())}
+    for day, count in day_counts.items():
+        inc[f"daily.{day}"] = -count
+    await db[ROLLUPS].update_one(
+        {"_id": user_id},
+        {"$inc": inc, "$unset": {f"habit_totals.{habit_id}": "", f"habit_streaks.{habit_id}": ""}},
+    )
+
+
+async def on_habit_completed(db, user_id: str, habit_id: str, day: str, streak: int):
+    await db[ROLLUPS].update_one(
+        {"_id": user_id},
+        {
+            "$inc": {"total_completions": 1, f"daily.{day}": 1, f"habit_totals.{habit_id}": 1},
+            "$set": {f"habit_streaks.{habit_id}": streak},
+        },
+    )
+
+
+async def rebuild_rollup(db, user_id: str) -> Dict[str, Any]:
+    """Recompute a user's rollup from habits and completion buckets."""
+    habits = await db.habits.find({"user_id": user_id}, {"frequency": 1, "streak": 1}).to_list(length=None)
+
+    frequency: Dict[str, int] = {}
+    for habit in habits:
+        freq = _key(habit.get("frequency", "daily"))
+        frequency[freq] = frequency.get(freq, 0) + 1
+
+    habit_totals = {str(habit["_id"]): 0 for habit in habits}
+    rows = await db[completions.BUCKETS].aggregate([
+        {"$match": {"user_id": user_id}},
+        {"$group": {"_id": "$habit_id", "count": {"$sum": "$count"}}},
+    ]).to_list(length=None)
+    for row in rows:
+        if row["_id"] in habit_totals:
+            habit_totals[row["_id"]] = row["count"]
+
+    rollup = {
+        "_id": user_id,
+        "total_habits": len(habits),
+        "total_completions": sum(habit_totals.values()),
+        "daily": await completions.completion_day_counts(db, user_id),
+        "habit_totals": habit_totals,
+        "habit_streaks": {str(habit["_id"]): habit.get("streak", 0) for habit in habits},
+        "frequency": frequency,
+        "built_at": datetime.utcnow(),
+    }
+    await db[ROLLUPS].replace_one({"_id": user_id}, rollup, upsert=True)
+    return rollup
+
+
+async def rebuild_all(db, user_id: Optional[str] = None) -> int:
+    """Rebuild rollups for one user or for every user with habits; returns the number rebuilt."""
+    user_ids = [user_id] if user_id else await db.habits.distinct("user_id")
+    for uid in user_ids:
+        await rebuild_rollup(db, uid)
+    return len(user_ids)
+
+
+async def get_rollup(db, user_id: str) -> Dict[str, Any]:
+    rollup = await db[ROLLUPS].find_one({"_id": user_id})
+    if rollup is None:
+        rollup = await rebuild_rollup(db, user_id)
+    return rollup
+
+
+def summarize(rollup: Dict[str, Any], days: int = 7) -> Dict[str, Any]:
+    """Derive the dashboard figures shared by the summary and detailed endpoints."""
+    today = datetime.utcnow().date()
+    daily = rollup.get("daily", {})
+    streaks = list(rollup.get("habit_streaks", {}).values())
+    total_habits = rollup.get("total_habits", 0)
+    recent = {
+        (today - timedelta(days=i)).isoformat(): daily.get((today - timedelta(days=i)).isoformat(), 0)
+        for i in range(days)
+    }
+    return {
+        "total_habits": total_habits,
+        "completed_today": daily.get(today.isoformat(), 0),
+        "highest_streak": max(streaks, default=0),
+        "average_streak": sum(streaks) / total_habits if total_habits > 0 else 0,
+        "recent_completions": recent,
+    }
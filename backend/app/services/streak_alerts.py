@@ -1,39 +1,62 @@
 from datetime import datetime, timedelta
-from typing import List, Optional
-
-from beanie import PydanticObjectId
 
 from app.core.database import get_db
-from app.models.habit import Habit
-from app.models.user import User
-from app.services.email import send_email
+from app.services.completions import day_start
+from app.services import outbox
+
+# Streak lengths that trigger an alert
+STREAK_MILESTONE_DAYS = 7
+
+
+def streak_milestones_pipeline(since: datetime) -> list:
+    """Recently completed habits sitting on a streak milestone, joined with opted-in owners."""
+    return [
+        # Backed by the (last_completed, streak) index: only recently completed habits are read
+        {"$match": {
+            "last_completed": {"$gte": since},
+            "streak": {"$gt": 0, "$mod": [STREAK_MILESTONE_DAYS, 0]},
+        }},
+        {"$project": {"name": 1, "streak": 1, "last_completed": 1, "user_oid": {"$convert": {"input": "$user_id", "to": "objectId", "onError": None}}}},
+        {"$lookup": {
+            "from": "users",
+            "localField": "user_oid",
+            "foreignField": "_id",
+            "pipeline": [
+                {"$match": {"settings.streakAlerts": True, "settings.notifications": True, "email": {"$ne": None}}},
+                {"$project": {"email": 1, "name": 1}},
+            ],
+            "as": "user",
+        }},
+        {"$unwind": "$user"},
+        {"$project": {
+            "_id": 0, "habit_id": {"$toString": "$_id"}, "user_id": {"$toString": "$user._id"},
+            "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$last_completed"}},
+            "habit_name": "$name", "streak": 1, "email": "$user.email", "user_name": "$user.name",
+        }},
+    ]
+
 
 async def check_and_send_streak_alerts():
     """Checks for streak milestones and sends alerts to users who have enabled them."""
     db = await get_db()
+    # Milestones reached by completions since the start of yesterday
+    since = day_start(datetime.utcnow().date() - timedelta(days=1))
+
+    notifications = []
+    async for milestone in db.habits.aggregate(streak_milestones_pipeline(since)):
+        habit_name = milestone.get("habit_name") or "Your habit"
+        user_name = milestone.get("user_name") or "User"
+        streak = milestone["streak"]
+        # Keyed by the day the milestone was reached, so overlapping runs alert once
+        notifications.append(outbox.notification(
+            outbox.streak_key(milestone["habit_id"], streak, milestone["day"]),
+            kind="streak_alert",
+            user_id=milestone["user_id"],
+            recipients=[milestone["email"]],
+            subject=f"Streak Alert for {habit_name}!",
+            body=f"Congratulations {user_name}! You've reached a {streak}-day streak for your habit: {habit_name}! Keep up the great work!",
+            summary=f"{streak}-day streak on {habit_name}",
+            user_name=milestone.get("user_name"),
+        ))
 
-    users_cursor = db.users.find({"settings.streakAlerts": True, "settings.notifications": True})
-    async for user_dict in users_cursor:
-        try:
-            # user_dict is a plain dict from MongoDB, not a User model instance
-            user_id = str(user_dict["_id"])
-            user_name = user_dict.get("name", "User")
-            user_email = user_dict.get("email")
-            
-            if not user_email:
-                continue
-            
-            user_habits = await db.habits.find({"user_id": user_id}).to_list(length=None)
-            for habit in user_habits:
-                streak = habit.get("streak", 0)
-                if streak > 0 and streak % 7 == 0:
-                    habit_name = habit.get("name", "Your habit")
-                    subject = f"Streak Alert for {habit_name}!"
-                    body = f"Congratulations {user_name}! You've reached a {streak}-day streak for your habit: {habit_name}! Keep up the great work!"
-                    await send_email(
-                        subject=subject,
-                        recipient=user_email,
-                        body=body
-                    )
-        except Exception as e:
-            print(f"Error sending streak alert to user: {e}")
+    await outbox.enqueue(db, notifications)
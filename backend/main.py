@@ -1,12 +1,18 @@
 from fastapi import FastAPI
 from app.api.routers import users, habits, ai
-from app.core.database import lifespan
+from app.core.database import lifespan, get_db
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from fastapi_utils.tasks import repeat_every
-from app.services.reminders import check_and_send_reminders
+from app.services.reminders import reminder_timer
 from app.services.ai_insights import generate_and_send_ai_insights
 from app.services.streak_alerts import check_and_send_streak_alerts
+from app.services.outbox import dispatch_notifications
+from app.core.migrations import run_migrations
+from app.core.security import listen_for_invalidations
+from app.core.metrics import MetricsMiddleware, metrics_response
+from app.core.scheduler import CATCH_UP_ONCE, CATCH_UP_SKIP, Job, run_scheduler
+from app.services.email import mailer
 from app.core.config import settings
 import asyncio
 
@@ -16,45 +22,39 @@ async def app_lifespan(app: FastAPI):
     # Startup: Initialize database and start background tasks
     async with lifespan(app):
         print(f"Starting up in {settings.ENVIRONMENT} mode")
+        # Blocks until every migration is applied (by this or another worker);
+        # a failed migration aborts startup rather than serving a half-migrated database
+        applied = await run_migrations(await get_db())
+        if applied:
+            print(f"Applied migrations: {applied}")
         
         # Start background tasks
-        task1 = asyncio.create_task(schedule_reminders())
-        task2 = asyncio.create_task(schedule_ai_insights())
-        task3 = asyncio.create_task(schedule_streak_alerts())
+        tasks = [
+            asyncio.create_task(run_scheduler(get_db, JOBS)),
+            # Runs everywhere, but only the worker holding its lease loads reminders from the database
+            asyncio.create_task(reminder_timer.run(get_db)),
+        ]
+        if settings.USER_CACHE_BROADCAST:
+            tasks.append(asyncio.create_task(listen_for_invalidations(await get_db())))
         
         yield
         
         # Shutdown: Cancel background tasks
-        task1.cancel()
-        task2.cancel()
-        task3.cancel()
+        for task in tasks:
+            task.cancel()
+        await mailer.stop()
 
-async def schedule_reminders():
-    """Background task for checking reminders every minute"""
-    while True:
-        try:
-            await check_and_send_reminders()
-        except Exception as e:
-            print(f"Error in reminder task: {e}")
-        await asyncio.sleep(60)  # 1 minute
-
-async def schedule_ai_insights():
-    """Background task for generating AI insights weekly"""
-    while True:
-        try:
-            await generate_and_send_ai_insights()
-        except Exception as e:
-            print(f"Error in AI insights task: {e}")
-        await asyncio.sleep(604800)  # 1 week
-
-async def schedule_streak_alerts():
-    """Background task for checking streak alerts daily"""
-    while True:
-        try:
-            await check_and_send_streak_alerts()
-        except Exception as e:
-            print(f"Error in streak alerts task: {e}")
-        await asyncio.sleep(86400)  # 1 day
+# Background jobs, run once per cron occurrence across all workers (times in UTC).
+# Reminders are not polled: reminder_timer fires each one when it is due.
+JOBS = [
+    Job("schedule_ai_insights", settings.AI_INSIGHTS_CRON, generate_and_send_ai_insights,
+        catch_up=CATCH_UP_ONCE, jitter_seconds=600),
+    Job("schedule_streak_alerts", settings.STREAK_ALERTS_CRON, check_and_send_streak_alerts,
+        catch_up=CATCH_UP_ONCE, jitter_seconds=300),
+    # Jobs above only enqueue notifications; this drains the outbox over SMTP
+    Job("dispatch_notifications", settings.OUTBOX_DISPATCH_CRON, dispatch_notifications,
+        catch_up=CATCH_UP_SKIP, misfire_grace_seconds=60, retry_seconds=60),
+]
 
 app = FastAPI(lifespan=app_lifespan)
 
@@ -70,6 +70,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route request count/latency, exposed on /metrics
+app.add_middleware(MetricsMiddleware)
+
 
 app.include_router(users.router)
 app.include_router(habits.router)
@@ -77,4 +80,8 @@ app.include_router(ai.router)
 
 @app.get("/")
 async def read_root():
-    return {"message": "Welcome to the FastAPI backend!"}
\ No newline at end of file
+    return {"message": "Welcome to the FastAPI backend!"}
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return metrics_response()
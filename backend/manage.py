@@ -0,0 +1,44 @@
+import argparse
+import asyncio
+
+from app.core.database import lifespan, get_db
+from app.core.migrations import MIGRATIONS, applied_versions, run_migrations
+from app.services import stats
+
+
+async def migrate(args):
+    """Create indexes and apply pending data migrations."""
+    async with lifespan(None):
+        db = await get_db()
+        applied = await run_migrations(db)
+        print(f"✅ Applied migrations: {applied}" if applied else "✅ No pending migrations")
+
+
+async def show_migrations(args):
+    """List migrations and whether they have been applied."""
+    async with lifespan(None):
+        done = set(await applied_versions(await get_db()))
+        for version, description, _ in MIGRATIONS:
+            print(f"{'[x]' if version in done else '[ ]'} {version}: {description}")
+
+
+async def rebuild_stats(args):
+    """Recompute dashboard stats rollups from habits and completion buckets."""
+    async with lifespan(None):
+        db = await get_db()
+        rebuilt = await stats.rebuild_all(db, user_id=args.user_id)
+        print(f"✅ Rebuilt stats rollups for {rebuilt} users")
+
+
+COMMANDS = {
+    "migrate": migrate,
+    "show-migrations": show_migrations,
+    "rebuild-stats": rebuild_stats,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Habit tracker maintenance commands")
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    parser.add_argument("--user-id", help="Limit rebuild-stats to a single user")
+    args = parser.parse_args()
+    asyncio.run(COMMANDS[args.command](args))
@@ -0,0 +1,54 @@
+import os
+import sys
+import uuid
+
+import pytest
+
+# Settings are read from the environment at import time; give the required ones
+# harmless values so app modules can be imported without a .env file.
+for name, value in {
+    "SECRET_KEY": "test-secret",
+    "GEMINI_API_KEY": "test-key",
+    "MAIL_USERNAME": "test",
+    "MAIL_PASSWORD": "test",
+    "MAIL_FROM": "noreply@example.com",
+    "MAIL_PORT": "1025",
+    "MAIL_SERVER": "127.0.0.1",
+    "MAIL_FROM_NAME": "Habit Tracker",
+    "MAIL_STARTTLS": "false",
+    "MAIL_SSL_TLS": "false",
+    "USE_CREDENTIALS": "false",
+    "VALIDATE_CERTS": "false",
+}.items():
+    os.environ.setdefault(name, value)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MONGO_TEST_URL = os.getenv("MONGO_TEST_URL", "mongodb://localhost:27017")
+
+
+@pytest.fixture(scope="session")
+def mongo_client():
+    from pymongo import MongoClient
+    from pymongo.errors import PyMongoError
+
+    client = MongoClient(MONGO_TEST_URL, serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command("ping")
+    except PyMongoError:
+        pytest.skip(f"no MongoDB reachable at {MONGO_TEST_URL}")
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def mongo_db(mongo_client):
+    """A throwaway database with every index from app.core.migrations.INDEXES created."""
+    from app.core.migrations import INDEXES
+
+    db = mongo_client[f"habit_tracker_test_{uuid.uuid4().hex[:8]}"]
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            db[collection].create_index(keys, **options)
+    yield db
+    mongo_client.drop_database(db.name)
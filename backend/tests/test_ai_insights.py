@@ -0,0 +1,97 @@
+import asyncio
+import json
+
+import pytest
+
+from app.services import ai_insights, llm, outbox
+
+
+class AsyncCursor:
+    def __init__(self, docs):
+        self.docs = list(docs)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self.docs:
+            yield doc
+
+
+class Collection:
+    def __init__(self, docs=()):
+        self.docs = list(docs)
+
+    def find(self, query, projection=None):
+        return AsyncCursor(self.docs)
+
+
+class Db:
+    def __init__(self, enqueued_ids=()):
+        self.habits = Collection()
+        self.collections = {outbox.OUTBOX_COLLECTION: Collection({"_id": key} for key in enqueued_ids)}
+
+    def __getitem__(self, name):
+        return self.collections[name]
+
+
+def make_users(count):
+    return [{"_id": f"u{i}", "name": f"User {i}", "email": f"u{i}@example.com"} for i in range(count)]
+
+
+def batch_reply(prompt):
+    ids = [line.split("id: ")[1].split(" |")[0] for line in prompt.splitlines() if line.startswith("- id: ")]
+    return json.dumps({user_id: f"Keep going with your habits, {user_id}!" for user_id in ids})
+
+
+@pytest.fixture
+def enqueued(monkeypatch):
+    batches = []
+
+    async def enqueue(db, notifications):
+        batches.append([n["user_id"] for n in notifications])
+        return len(notifications)
+
+    monkeypatch.setattr(outbox, "enqueue", enqueue)
+    monkeypatch.setattr(ai_insights.settings, "INSIGHT_PROMPT_BATCH_SIZE", 2)
+    monkeypatch.setattr(ai_insights.settings, "INSIGHT_LLM_CONCURRENCY", 4)
+    return batches
+
+
+def test_open_circuit_cancels_other_groups_and_keeps_generated_insights(monkeypatch, enqueued):
+    cancelled = []
+
+    async def generate(prompt, **kwargs):
+        if "id: u0 " in prompt:
+            return batch_reply(prompt)
+        if "id: u2 " in prompt:
+            await asyncio.sleep(0.05)
+            raise llm.CircuitOpenError("Gemini is unavailable")
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(prompt)
+            raise
+
+    monkeypatch.setattr(llm, "generate", generate)
+
+    with pytest.raises(llm.CircuitOpenError):
+        asyncio.run(asyncio.wait_for(ai_insights._process_batch(Db(), make_users(6), "2024-W23"), timeout=2))
+    assert len(cancelled) == 1
+    assert enqueued == [["u0", "u1"]]
+
+
+def test_resumed_batch_skips_users_already_enqueued(monkeypatch, enqueued):
+    prompts = []
+
+    async def generate(prompt, **kwargs):
+        prompts.append(prompt)
+        return batch_reply(prompt)
+
+    monkeypatch.setattr(llm, "generate", generate)
+    db = Db(enqueued_ids=[outbox.insight_key("u0", "2024-W23"), outbox.insight_key("u1", "2024-W23")])
+
+    outcome = asyncio.run(ai_insights._process_batch(db, make_users(4), "2024-W23"))
+    assert enqueued == [["u2", "u3"]]
+    assert outcome == {"queued": 2, "failed": 0}
+    assert not any("id: u0 " in p or "id: u1 " in p for p in prompts)
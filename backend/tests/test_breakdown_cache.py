@@ -0,0 +1,91 @@
+import asyncio
+
+from app.core.config import settings
+from app.services import breakdown_cache, llm
+from app.services.breakdown_cache import BreakdownIndex, jaccard, normalize_goal, shingles
+
+THRESHOLD = settings.BREAKDOWN_SIMILARITY_THRESHOLD
+RESPONSE = {"habits": [], "advice": "cached"}
+
+
+def index_with(*goals):
+    index = BreakdownIndex(maxsize=100)
+    for goal in goals:
+        normalized = normalize_goal(goal)
+        index.add(f"daily|{normalized}", "daily", normalized, {**RESPONSE, "goal": goal})
+    return index
+
+
+def similar(index, goal, duration="daily"):
+    return index.most_similar(duration, normalize_goal(goal), THRESHOLD)
+
+
+def test_normalize_goal_drops_filler_and_plurals():
+    assert normalize_goal("I want to read books!") == "read book"
+    assert normalize_goal("Lose weight!") == normalize_goal("lose some weight")
+    assert normalize_goal("the") == "the"
+
+
+def test_normalize_goal_keeps_polarity_and_quantity():
+    assert normalize_goal("Start eating sugar") == "start eating sugar"
+    assert normalize_goal("Stop eating sugar") == "stop eating sugar"
+    assert normalize_goal("eat more vegetables") != normalize_goal("eat vegetables")
+
+
+def test_similar_goal_is_a_hit():
+    index = index_with("go running every morning before work")
+    match = similar(index, "Go running every morning before working")
+    assert match is not None
+    assert match[0] == "daily|go running every morning before work"
+
+
+def test_near_miss_below_threshold_is_not_served():
+    index = index_with("learn to cook healthy meals")
+    goal = "learn cooking healthy meals"
+    assert jaccard(shingles(normalize_goal(goal)), shingles("learn cook healthy meal")) < THRESHOLD
+    assert similar(index, goal) is None
+
+
+def test_other_duration_is_not_served():
+    index = index_with("go running every morning before work")
+    assert similar(index, "go running every morning before working", duration="weekly") is None
+
+
+def test_numbers_must_match():
+    cached = "run 10 miles every week before the summer holidays"
+    goal = "run 100 miles every week before the summer holidays"
+    index = index_with(cached)
+    # Close enough as text, but a different goal
+    assert jaccard(shingles(normalize_goal(goal)), shingles(normalize_goal(cached))) >= THRESHOLD
+    assert similar(index, goal) is None
+    assert similar(index, cached) is not None
+
+
+def test_polarity_must_match():
+    index = index_with("stop eating sugar after dinner every single evening")
+    assert similar(index, "start eating sugar after dinner every single evening") is None
+
+
+def test_fallback_breakdowns_are_never_cached(monkeypatch):
+    from app.api.routers import ai
+    from app.schemas.schemas import GoalBreakdownRequest
+
+    stored = []
+
+    async def miss(db, goal, duration):
+        return None
+
+    async def store(db, goal, duration, response):
+        stored.append(goal)
+
+    async def unavailable(prompt, **kwargs):
+        raise llm.CircuitOpenError("Gemini is unavailable")
+
+    monkeypatch.setattr(breakdown_cache, "lookup", miss)
+    monkeypatch.setattr(breakdown_cache, "store", store)
+    monkeypatch.setattr(llm, "generate", unavailable)
+
+    request = GoalBreakdownRequest(goal="read more books", duration="daily")
+    response = asyncio.run(ai.breakdown_goal(request, db=None, current_user=None))
+    assert response == ai.fallback_breakdown("read more books", "daily")
+    assert stored == []
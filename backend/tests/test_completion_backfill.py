@@ -0,0 +1,36 @@
+from datetime import datetime
+
+from app.services import completions
+
+
+def test_full_timestamps_are_converted_to_utc():
+    assert completions._as_datetime({"date": "2024-06-01", "completed_at": "2024-06-01T09:30:00+02:00"}) == {
+        "at": datetime(2024, 6, 1, 7, 30)
+    }
+    assert completions._as_datetime({"completed_at": "2024-06-01T07:30:00Z"}) == {"at": datetime(2024, 6, 1, 7, 30)}
+
+
+def test_date_only_events_fall_back_to_midnight():
+    expected = {"at": datetime(2024, 6, 1), "date_only": True}
+    assert completions._as_datetime({"date": "2024-06-01", "completed_at": None}) == expected
+    assert completions._as_datetime({"date": "2024-06-01", "completed_at": "garbage"}) == expected
+
+
+def test_malformed_events_are_not_converted():
+    assert completions._as_datetime({"completed_at": ""}) is None
+    assert completions._as_datetime({"completed_at": "garbage"}) is None
+    assert completions._as_datetime({"date": "not a date"}) is None
+    assert completions._as_datetime({}) is None
+
+
+def test_malformed_events_are_dropped_from_the_bucket(capsys):
+    bucket = {"_id": "b1", "events": [
+        {"date": "2024-06-01", "completed_at": None},
+        {"completed_at": ""},
+        {"at": datetime(2024, 6, 2, 8)},
+    ]}
+    assert completions._converted_events(bucket) == [
+        {"at": datetime(2024, 6, 1), "date_only": True},
+        {"at": datetime(2024, 6, 2, 8)},
+    ]
+    assert "Dropping malformed completion event" in capsys.readouterr().out
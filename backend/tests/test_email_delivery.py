@@ -0,0 +1,180 @@
+"""MailDeliveryService against a local aiosmtpd server."""
+import asyncio
+import socket
+import time
+
+import pytest
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import SMTP
+
+from app.core.config import settings
+from app.services.email import MailDeliveryService, build_message
+
+
+class Recorder:
+    """aiosmtpd handler keeping received messages and the connection each arrived on."""
+
+    def __init__(self):
+        self.messages = []
+        self.drop_after_next = False
+        self.data_delay = 0.0
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("reject@"):
+            return "550 mailbox unavailable"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        await asyncio.sleep(self.data_delay)
+        self.messages.append((session.peer, envelope.rcpt_tos))
+        if self.drop_after_next:
+            # Drop the connection right after acknowledging, like a server timing out an idle client
+            self.drop_after_next = False
+            asyncio.get_running_loop().call_later(0.05, server.transport.close)
+        return "250 Message accepted"
+
+
+class TrackingSMTP(SMTP):
+    def __init__(self, *args, connections=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._connections = connections
+
+    def connection_made(self, transport):
+        self._connections["opened"] += 1
+        super().connection_made(transport)
+
+    def connection_lost(self, exc):
+        self._connections["closed"] += 1
+        super().connection_lost(exc)
+
+
+class TrackingController(Controller):
+    def __init__(self, handler, **kwargs):
+        super().__init__(handler, **kwargs)
+        self.connections = {"opened": 0, "closed": 0}
+
+    def factory(self):
+        return TrackingSMTP(self.handler, connections=self.connections)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    handler = Recorder()
+    port = _free_port()
+    controller = TrackingController(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    # start() makes a probe connection of its own; let it close, then count only the mailer's
+    time.sleep(0.1)
+    controller.connections.update(opened=0, closed=0)
+    monkeypatch.setattr(settings, "MAIL_SERVER", "127.0.0.1")
+    monkeypatch.setattr(settings, "MAIL_PORT", port)
+    monkeypatch.setattr(settings, "MAIL_STARTTLS", False)
+    monkeypatch.setattr(settings, "MAIL_SSL_TLS", False)
+    monkeypatch.setattr(settings, "USE_CREDENTIALS", False)
+    yield handler, controller
+    controller.stop()
+
+
+def _message(to):
+    return build_message("Hello", to, "<p>Hi</p>")
+
+
+def test_connection_is_reused_across_messages(smtp_server):
+    handler, controller = smtp_server
+
+    async def run():
+        mailer = MailDeliveryService(pool_size=1, idle_timeout=30)
+        try:
+            return await mailer.deliver([_message(f"user{i}@example.com") for i in range(5)])
+        finally:
+            await mailer.stop()
+
+    results = asyncio.run(run())
+    assert all(r.ok for r in results)
+    assert len(handler.messages) == 5
+    assert len({peer for peer, _ in handler.messages}) == 1
+    assert controller.connections["opened"] == 1
+
+
+def test_reconnects_after_server_disconnect(smtp_server):
+    handler, controller = smtp_server
+
+    async def run():
+        mailer = MailDeliveryService(pool_size=1, idle_timeout=30)
+        try:
+            handler.drop_after_next = True
+            first = await mailer.deliver([_message("a@example.com")])
+            await asyncio.sleep(0.2)
+            second = await mailer.deliver([_message("b@example.com")])
+            return first + second
+        finally:
+            await mailer.stop()
+
+    results = asyncio.run(run())
+    assert [r.ok for r in results] == [True, True]
+    assert [rcpts for _, rcpts in handler.messages] == [["a@example.com"], ["b@example.com"]]
+    assert controller.connections["opened"] == 2
+
+
+def test_idle_connection_is_closed(smtp_server):
+    handler, controller = smtp_server
+
+    async def run():
+        mailer = MailDeliveryService(pool_size=1, idle_timeout=0.2)
+        try:
+            await mailer.deliver([_message("a@example.com")])
+            assert controller.connections["closed"] == 0
+            await asyncio.sleep(0.6)
+            return controller.connections["closed"]
+        finally:
+            await mailer.stop()
+
+    assert asyncio.run(run()) == 1
+
+
+def test_delivery_results_and_stats(smtp_server):
+    handler, _ = smtp_server
+
+    async def run():
+        mailer = MailDeliveryService(pool_size=2, idle_timeout=30)
+        try:
+            results = await mailer.deliver([
+                _message("ok@example.com"),
+                _message("reject@example.com"),
+                _message(["x@example.com", "y@example.com"]),
+            ])
+            return results, mailer.stats.as_dict()
+        finally:
+            await mailer.stop()
+
+    results, stats = asyncio.run(run())
+    ok, rejected, multi = results
+    assert ok.ok and ok.error is None and ok.recipients == ["ok@example.com"] and ok.latency > 0
+    assert not rejected.ok and rejected.error and rejected.recipients == ["reject@example.com"]
+    assert multi.ok and multi.recipients == ["x@example.com", "y@example.com"]
+    assert all(r.subject == "Hello" for r in results)
+    assert stats["sent"] == 2 and stats["failed"] == 1
+
+
+def test_stop_resolves_queued_and_in_flight_messages(smtp_server):
+    handler, _ = smtp_server
+    handler.data_delay = 1.0
+
+    async def run():
+        mailer = MailDeliveryService(pool_size=1, idle_timeout=30)
+        futures = [await mailer.submit(_message(f"user{i}@example.com")) for i in range(3)]
+        await asyncio.sleep(0.2)
+        await mailer.stop()
+        return await asyncio.wait_for(asyncio.gather(*futures), timeout=1)
+
+    in_flight, *queued = asyncio.run(run())
+    assert not in_flight.ok and "during delivery" in in_flight.error
+    assert all(not r.ok and "before delivery" in r.error for r in queued)
+    assert [r.recipients for r in queued] == [["user1@example.com"], ["user2@example.com"]]
@@ -0,0 +1,72 @@
+import asyncio
+import time
+
+import pytest
+
+from app.services import llm
+
+
+class FakeResponse:
+    text = "ok"
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    fresh = llm.CircuitBreaker(window=60, min_calls=5, failure_rate=0.5, slow_seconds=0.5, open_seconds=30)
+    monkeypatch.setattr(llm, "breaker", fresh)
+    monkeypatch.setattr(llm, "_semaphore", None)
+    monkeypatch.setattr(llm.settings, "LLM_MAX_CONCURRENCY", 2)
+    return fresh
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_waiting_for_a_slot_is_not_a_gemini_failure(breaker):
+    async def healthy():
+        await asyncio.sleep(0.1)
+        return FakeResponse()
+
+    async def main():
+        return await asyncio.gather(*(llm._call(healthy, 0.15) for _ in range(12)), return_exceptions=True)
+
+    results = run(main())
+    assert results.count("ok") == 2
+    assert all(isinstance(r, llm.LLMTimeoutError) for r in results if r != "ok")
+    assert breaker.state == llm.CLOSED
+    assert len(breaker._calls) == 2
+
+
+def test_upstream_errors_open_the_breaker(breaker):
+    async def failing():
+        raise RuntimeError("upstream 500")
+
+    async def main():
+        for _ in range(5):
+            with pytest.raises(llm.LLMError):
+                await llm._call(failing, 1)
+
+    run(main())
+    assert breaker.state == llm.OPEN
+    assert breaker.rejecting()
+
+
+def test_upstream_stall_counts_as_failure(breaker):
+    async def stalled():
+        await asyncio.sleep(1)
+        return FakeResponse()
+
+    async def main():
+        with pytest.raises(llm.LLMTimeoutError):
+            await llm._call(stalled, 0.6)
+
+    run(main())
+    assert list(healthy for _, healthy in breaker._calls) == [False]
+
+
+def test_half_open_probe_is_not_claimed_by_rejecting(breaker):
+    breaker._open(time.monotonic() - breaker.open_seconds - 1)
+    assert not breaker.rejecting()
+    assert breaker.allow()
+    assert breaker.rejecting()
@@ -0,0 +1,94 @@
+import asyncio
+from collections import Counter
+
+import pytest
+
+from app.core import migrations
+from app.core.migrations import INDEXES, MIGRATIONS
+
+INDEX_VERSIONS = [1, 5, 6, 7, 8, 9, 10]
+
+
+class RecordingCollection:
+    def __init__(self, name, created):
+        self.name = name
+        self.created = created
+
+    async def create_index(self, keys, **options):
+        self.created.append((self.name, options["name"]))
+
+
+class RecordingDb:
+    def __init__(self):
+        self.created = []
+
+    def __getitem__(self, name):
+        return RecordingCollection(name, self.created)
+
+    def __getattr__(self, name):
+        return self[name]
+
+
+def created_by(version):
+    db = RecordingDb()
+    migration = next(m for v, _, m in MIGRATIONS if v == version)
+    asyncio.run(migration(db))
+    return db.created
+
+
+def test_every_index_is_created_by_exactly_one_migration():
+    created = Counter(index for version in INDEX_VERSIONS for index in created_by(version))
+    declared = {(collection, options["name"]) for collection, indexes in INDEXES.items() for _, options in indexes}
+    assert set(created) == declared
+    assert all(count == 1 for count in created.values())
+
+
+def test_index_migrations_only_create_what_they_describe():
+    assert created_by(6) == [("habits", "streak_milestones")]
+    assert created_by(8) == [("notification_outbox", "user_status")]
+    assert created_by(9) == [("chat_sessions", "user_updated_at")]
+
+
+def test_versions_are_unique_and_ordered():
+    versions = [version for version, _, _ in MIGRATIONS]
+    assert versions == sorted(set(versions))
+
+
+class HeartbeatCollection:
+    def __init__(self, matches):
+        self.matches = list(matches)
+        self.beats = 0
+
+    async def update_one(self, filter, update):
+        self.beats += 1
+        matched = self.matches.pop(0) if self.matches else 1
+
+        class Result:
+            matched_count = matched
+
+        return Result()
+
+
+def test_running_migration_renews_its_heartbeat(monkeypatch):
+    monkeypatch.setattr(migrations, "MIGRATION_HEARTBEAT_SECONDS", 0.01)
+    collection = HeartbeatCollection([1, 1, 1])
+
+    async def slow_migration(db):
+        await asyncio.sleep(0.1)
+
+    asyncio.run(migrations._apply({migrations.MIGRATIONS_COLLECTION: collection}, 2, slow_migration))
+    assert collection.beats >= 3
+
+
+def test_migration_is_cancelled_when_its_claim_is_taken_over(monkeypatch):
+    monkeypatch.setattr(migrations, "MIGRATION_HEARTBEAT_SECONDS", 0.01)
+    collection = HeartbeatCollection([1, 0])
+    finished = []
+
+    async def slow_migration(db):
+        await asyncio.sleep(1)
+        finished.append(True)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(migrations._apply({migrations.MIGRATIONS_COLLECTION: collection}, 2, slow_migration))
+    assert finished == []
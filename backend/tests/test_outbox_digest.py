@@ -0,0 +1,76 @@
+"""
+A user's notifications enqueued within one digest window go out as one email.
+
+The dispatch test runs against a real mongod (MONGO_TEST_URL) and is skipped
+when none is reachable.
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+from app.core.config import settings
+from app.services import outbox
+from app.services.email import DeliveryResult
+from tests.conftest import MONGO_TEST_URL
+
+
+def reminders(user_id, count):
+    return [
+        outbox.notification(
+            outbox.reminder_key(f"habit{i}", "2024-06-01"),
+            kind="reminder",
+            user_id=user_id,
+            recipients=["ada@example.com"],
+            subject=f"Reminder: Habit {i}",
+            body=f"<p>Complete Habit {i}</p>",
+            summary=f"Complete your habit: Habit {i}",
+            user_name="Ada",
+        )
+        for i in range(count)
+    ]
+
+
+def test_notifications_are_held_for_the_digest_window():
+    assert settings.NOTIFICATION_DIGEST_WINDOW_SECONDS > 0
+    (entry,) = reminders("u1", 1)
+    assert entry["next_attempt_at"] > datetime.utcnow()
+
+
+def test_one_users_notifications_group_into_one_digest():
+    grouped = outbox._group_messages(reminders("u1", 8) + reminders("u2", 1))
+    assert len(grouped) == 2
+    digest, docs = grouped[0]
+    assert len(docs) == 8
+    assert digest["Subject"] == "Your habit update: 8 notifications"
+    body = digest.get_content()
+    assert all(f"Habit {i}" in body for i in range(8))
+
+
+def test_reminders_within_one_window_are_sent_as_one_digest(mongo_db, monkeypatch):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    sent = []
+
+    async def fake_deliver(messages):
+        sent.extend(messages)
+        return [DeliveryResult(recipients=[m["To"]], subject=m["Subject"], ok=True) for m in messages]
+
+    monkeypatch.setattr(outbox.mailer, "deliver", fake_deliver)
+
+    async def main():
+        client = AsyncIOMotorClient(MONGO_TEST_URL)
+        db = client[mongo_db.name]
+        try:
+            entries = reminders("u1", 8)
+            # The first reminder's window has run out; the others fired later and are still held
+            entries[0]["next_attempt_at"] = datetime.utcnow() - timedelta(seconds=1)
+            await outbox.enqueue(db, entries)
+            return await outbox.dispatch_outbox(db)
+        finally:
+            client.close()
+
+    outcome = asyncio.run(main())
+    assert outcome["emails"] == 1
+    assert outcome["sent"] == 8
+    assert len(sent) == 1
+    assert sent[0]["Subject"] == "Your habit update: 8 notifications"
+    assert mongo_db[outbox.OUTBOX_COLLECTION].count_documents({"status": outbox.SENT}) == 8
@@ -0,0 +1,26 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from app.services import outbox
+
+
+def test_dispatch_soon_coalesces_requests_for_the_same_second(monkeypatch):
+    runs = []
+
+    async def fake_dispatch(db):
+        runs.append(datetime.utcnow())
+        return {"sent": 0, "retried": 0, "dead": 0, "emails": 0}
+
+    monkeypatch.setattr(outbox, "dispatch_outbox", fake_dispatch)
+
+    async def main():
+        now = datetime.utcnow()
+        for _ in range(5):
+            outbox.dispatch_soon(None, now)
+        outbox.dispatch_soon(None, now + timedelta(seconds=2))
+        await asyncio.gather(*outbox._tasks)
+
+    asyncio.run(main())
+    assert len(runs) == 2
+    assert runs[1] - runs[0] >= timedelta(seconds=1)
+    assert not outbox._wakeups
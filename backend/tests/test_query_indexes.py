@@ -0,0 +1,112 @@
+"""
+Every router and background-job query must be answered from an index.
+
+These run explain() against a real mongod (MONGO_TEST_URL, default
+mongodb://localhost:27017) and are skipped when none is reachable.
+"""
+from datetime import date, datetime, timedelta
+
+from bson import ObjectId
+
+from app.services import completions
+from app.services.streak_alerts import streak_milestones_pipeline
+
+
+def _stages(plan):
+    """Yield (stage, indexName) for every stage in an explain plan tree."""
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"], plan.get("indexName")
+        for value in plan.values():
+            yield from _stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _stages(value)
+
+
+def _winning_plan(explain):
+    """The first winningPlan in an explain result; aggregations nest it under their $cursor stage."""
+    if isinstance(explain, dict):
+        if "winningPlan" in explain:
+            return explain["winningPlan"]
+        values = explain.values()
+    elif isinstance(explain, list):
+        values = explain
+    else:
+        return None
+    for value in values:
+        plan = _winning_plan(value)
+        if plan is not None:
+            return plan
+    return None
+
+
+def assert_uses_index(explain, index_name):
+    stages = list(_stages(_winning_plan(explain)))
+    assert ("COLLSCAN", None) not in stages, stages
+    assert any(stage in ("IXSCAN", "EXPRESS_IXSCAN") and name == index_name for stage, name in stages), stages
+
+
+def explain_find(db, collection, query):
+    return db.command("explain", {"find": collection, "filter": query}, verbosity="queryPlanner")
+
+
+def explain_aggregate(db, collection, pipeline):
+    return db.command(
+        "explain", {"aggregate": collection, "pipeline": pipeline, "cursor": {}}, verbosity="queryPlanner"
+    )
+
+
+def _seed(db):
+    user_id = ObjectId()
+    db.users.insert_many([
+        {"_id": user_id, "email": "a@example.com", "username": "alice"},
+        {"email": "b@example.com", "username": "bob"},
+    ])
+    now = datetime.utcnow()
+    db.habits.insert_many([
+        {"user_id": str(user_id), "name": f"habit {i}", "reminder_enabled": i % 2 == 0,
+         "next_reminder_at": now + timedelta(minutes=i), "last_completed": now - timedelta(days=i), "streak": i}
+        for i in range(20)
+    ])
+    db[completions.BUCKETS].insert_many([
+        {"user_id": str(user_id), "habit_id": str(ObjectId()), "month": f"2026-{m:02d}", "count": 1,
+         "events": [{"at": datetime(2026, m, 1)}]}
+        for m in range(1, 13)
+    ])
+    return str(user_id)
+
+
+def test_habits_by_user_uses_index(mongo_db):
+    user_id = _seed(mongo_db)
+    assert_uses_index(explain_find(mongo_db, "habits", {"user_id": user_id}), "user_id")
+
+
+def test_due_reminders_uses_index(mongo_db):
+    _seed(mongo_db)
+    # The query ReminderTimer loads its window with
+    query = {"reminder_enabled": True, "next_reminder_at": {"$lt": datetime.utcnow() + timedelta(minutes=15)}}
+    assert_uses_index(explain_find(mongo_db, "habits", query), "reminder_due")
+
+
+def test_user_lookup_by_email_uses_index(mongo_db):
+    _seed(mongo_db)
+    assert_uses_index(explain_find(mongo_db, "users", {"email": "a@example.com"}), "email_unique")
+
+
+def test_user_lookup_by_username_uses_index(mongo_db):
+    _seed(mongo_db)
+    assert_uses_index(explain_find(mongo_db, "users", {"username": "alice"}), "username_unique")
+
+
+def test_analytics_bucket_range_uses_index(mongo_db):
+    user_id = _seed(mongo_db)
+    match = completions._bucket_match(user_id, date(2026, 3, 1), date(2026, 5, 31))
+    pipeline = [{"$match": match}, {"$unwind": "$events"}, {"$group": {"_id": "$habit_id", "count": {"$sum": 1}}}]
+    assert_uses_index(explain_aggregate(mongo_db, completions.BUCKETS, pipeline), "user_month")
+
+
+def test_streak_milestones_uses_index(mongo_db):
+    _seed(mongo_db)
+    pipeline = streak_milestones_pipeline(completions.day_start(date.today() - timedelta(days=1)))
+    assert_uses_index(explain_aggregate(mongo_db, "habits", pipeline[:1]), "streak_milestones")
@@ -0,0 +1,53 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from app.services import reminders
+
+
+def make_timer(monkeypatch, holds_lease):
+    timer = reminders.ReminderTimer(window=timedelta(minutes=15))
+    loads = []
+
+    async def fake_hold_lease(db, name, lease_seconds):
+        return holds_lease[0]
+
+    async def fake_load(db, now):
+        loads.append(now)
+        timer._loaded_until = now + timer.window
+
+    monkeypatch.setattr(reminders, "hold_lease", fake_hold_lease)
+    monkeypatch.setattr(timer, "_load", fake_load)
+    return timer, loads
+
+
+def test_only_the_lease_holder_loads_windows(monkeypatch):
+    holds_lease = [False]
+    timer, loads = make_timer(monkeypatch, holds_lease)
+    now = datetime.utcnow()
+
+    asyncio.run(timer._lead(None, now))
+    assert loads == []
+
+    holds_lease[0] = True
+    asyncio.run(timer._lead(None, now + reminders.REMINDER_LEASE_RENEW))
+    assert len(loads) == 1
+    # Renewing mid-window does not reload
+    asyncio.run(timer._lead(None, now + 2 * reminders.REMINDER_LEASE_RENEW))
+    assert len(loads) == 1
+
+    holds_lease[0] = False
+    asyncio.run(timer._lead(None, now + 3 * reminders.REMINDER_LEASE_RENEW))
+    assert timer._loaded_until == datetime.min
+
+
+def test_any_worker_fires_reminders_it_schedules(monkeypatch):
+    timer, _ = make_timer(monkeypatch, [False])
+    now = datetime.utcnow()
+    soon, later = ObjectId(), ObjectId()
+
+    timer.schedule(soon, now + timedelta(minutes=5))
+    timer.schedule(later, now + timedelta(hours=2))
+    assert timer._pop_due(now + timedelta(minutes=10)) == [soon]
+    assert timer._pop_due(now + timedelta(hours=3)) == []
@@ -0,0 +1,78 @@
+import asyncio
+from datetime import date, datetime, timedelta
+
+from bson import ObjectId
+
+from app.services import completions, scheduling
+
+
+def at(hour, minute, day=1):
+    return datetime(2024, 6, day, hour, minute)
+
+
+def test_circular_mean_wraps_around_midnight():
+    mean, concentration = scheduling.circular_mean([23 * 60 + 30, 30])
+    assert mean == 0
+    assert concentration > 0.99
+
+
+def test_circular_mean_of_opposite_times_has_no_concentration():
+    _, concentration = scheduling.circular_mean([6 * 60, 18 * 60])
+    assert concentration < 0.01
+
+
+def test_suggestion_around_midnight_leads_by_thirty_minutes():
+    times = [at(23, 30, 1), at(0, 30, 2), at(23, 50, 3), at(0, 10, 4)]
+    suggestion = scheduling.suggest_reminder("h1", "Read", times)
+    assert suggestion["suggested_time"] == "23:30"
+    assert "around 00:00" in suggestion["reason"]
+
+
+def test_empty_and_sparse_history_gives_no_suggestion():
+    assert scheduling.analyze([]) is None
+    assert scheduling.suggest_reminder("h1", "Read", []) is None
+    assert scheduling.suggest_reminder("h1", "Read", [at(7, 0), at(7, 10)]) is None
+
+
+def test_scattered_times_give_no_suggestion():
+    times = [at(h, 0, d) for d, h in enumerate([0, 4, 8, 12, 16, 20], start=1)]
+    assert scheduling.suggest_reminder("h1", "Read", times) is None
+
+
+def test_busiest_hour_is_used_when_times_are_not_clustered():
+    times = [at(7, 15, d) for d in range(1, 7)] + [at(19, 0, 7), at(13, 0, 8), at(22, 0, 9), at(2, 0, 10)]
+    suggestion = scheduling.suggest_reminder("h1", "Run", times, current_time="09:00")
+    assert suggestion["suggested_time"] == "06:30"
+    assert suggestion["current_time"] == "09:00"
+
+
+def test_suggestions_only_read_the_last_history_days(monkeypatch):
+    from app.api.routers import ai
+
+    habit_id = ObjectId()
+    calls = []
+
+    async def fetch_completions(db, user_id, start=None, end=None):
+        calls.append(start)
+        return [{"habit_id": str(habit_id), "completed_at": at(7, 0, d), "date_only": False} for d in range(1, 5)]
+
+    class Cursor:
+        async def to_list(self, length=None):
+            return [{"_id": habit_id, "name": "Run"}]
+
+    class Habits:
+        def find(self, *args, **kwargs):
+            return Cursor()
+
+    class Db:
+        habits = Habits()
+
+    class CurrentUser:
+        id = ObjectId()
+
+    monkeypatch.setattr(completions, "fetch_completions", fetch_completions)
+    response = asyncio.run(ai.get_schedule_suggestions(Db(), enhance=False, current_user=CurrentUser()))
+
+    assert calls == [datetime.utcnow().date() - timedelta(days=scheduling.HISTORY_DAYS)]
+    assert isinstance(calls[0], date)
+    assert response.suggestions[0].suggested_time == "06:30"